@@ -1,13 +1,15 @@
-import json
+import asyncio
 import re
-import time
 from pathlib import Path
 from urllib.parse import urljoin
 
+import aiohttp
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
 from rich.console import Console
-from rich.progress import track
+from rich.progress import Progress
 from rich.table import Table
 
 console = Console()
@@ -15,16 +17,30 @@ console = Console()
 # Base configuration
 BASE_URL = "https://handbook.agilelab.it"
 OUTPUT_PATH = Path("./data/corpus.json")
-DELAY = 0.4  # delay between requests
-
-
-def parse_sidebar(soup: BeautifulSoup) -> list[dict]:
+DELAY = 0.4  # delay between requests (per concurrent slot)
+CONCURRENCY = 8  # max in-flight requests against the handbook host
+TIMEOUT = 15
+USER_AGENT = "handbook-agent-crawler/0.1"
+
+# candidate main containers, by priority, depending on page layout
+MAIN_XPATHS = (
+    '//section[contains(concat(" ", normalize-space(@class), " "), " normal ")]',
+    '//div[contains(concat(" ", normalize-space(@class), " "), " page-inner ")]',
+    "//article",
+    "//main",
+    "//body",
+)
+NOISE_TAGS = ("script", "style", "nav", "footer", "header")
+_MULTI_NL = re.compile(r"\n{3,}")
+
+
+def parse_sidebar(tree: lxml_html.HtmlElement) -> list[dict]:
     """
     Extract all pages from the HonKit sidebar using data-level and data-path.
     Builds a structured list with section hierarchy.
     """
 
-    items = soup.find_all("li", attrs={"data-level": True})
+    items = tree.xpath("//li[@data-level]")
 
     pages: list[dict] = []
     seen_urls: set[str] = set()
@@ -33,18 +49,18 @@ def parse_sidebar(soup: BeautifulSoup) -> list[dict]:
     level_to_title: dict[str, str] = {}
 
     for li in items:
-        level = li["data-level"]  # e.g. "1.3.8"
+        level = li.get("data-level")  # e.g. "1.3.8"
         data_path = li.get("data-path", "").strip()  # e.g. "VacationPolicies.html"
         depth = len(level.split("."))
 
         # link or span (non-clickable section headers)
-        a = li.find("a", href=True)
-        span = li.find("span")
+        a = li.find(".//a[@href]")
+        span = li.find(".//span")
 
-        if a:
-            title = a.get_text(strip=True)
-        elif span:
-            level_to_title[level] = span.get_text(strip=True)
+        if a is not None:
+            title = a.text_content().strip()
+        elif span is not None:
+            level_to_title[level] = span.text_content().strip()
             continue
         else:
             continue
@@ -52,7 +68,7 @@ def parse_sidebar(soup: BeautifulSoup) -> list[dict]:
         level_to_title[level] = title
 
         # skip external links
-        href = a["href"].strip()
+        href = a.get("href").strip()
         if href.startswith("http") and not href.startswith(BASE_URL):
             continue
 
@@ -88,52 +104,115 @@ def get_all_page_links() -> list[dict]:
     """Download homepage and extract all page links."""
     console.log(f"[bold cyan]Downloading index:[/] {BASE_URL}")
 
-    resp = requests.get(BASE_URL, timeout=15)
+    resp = requests.get(BASE_URL, timeout=TIMEOUT, headers={"User-Agent": USER_AGENT})
     resp.raise_for_status()
 
-    soup = BeautifulSoup(resp.text, "lxml")
-    pages = parse_sidebar(soup)
+    tree = lxml_html.fromstring(resp.content)
+    pages = parse_sidebar(tree)
 
     console.log(f"[green]{len(pages)} pages found[/]")
     return pages
 
 
-def fetch_page_text(url: str) -> dict:
+def extract_page_text(html: bytes | str) -> dict:
     """
-    Download a page and extract clean text from main content container.
+    Extract clean text and h1 from the main content container of a page.
+    Single lxml pass: locate container, strip noise in place, read text.
     """
+    root = lxml_html.fromstring(html)
 
-    resp = requests.get(url, timeout=15)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "lxml")
-
-    # try several possible containers depending on page layout
-    main = (
-        soup.find("section", class_="normal")
-        or soup.find("div", class_="page-inner")
-        or soup.find("article")
-        or soup.find("main")
-        or soup.body
-    )
+    main = next((found[0] for xp in MAIN_XPATHS if (found := root.xpath(xp))), None)
 
     if main is None:
         return {"text": "", "h1": ""}
 
-    h1_tag = main.find("h1")
-    h1 = h1_tag.get_text(strip=True) if h1_tag else ""
+    h1_tag = main.find(".//h1")
+    h1 = h1_tag.text_content().strip() if h1_tag is not None else ""
 
-    # remove noise elements
-    for tag in main.find_all(["script", "style", "nav", "footer", "header"]):
-        tag.decompose()
+    # remove noise elements (keep their tail text, it belongs to the parent)
+    etree.strip_elements(main, etree.Comment, *NOISE_TAGS, with_tail=False)
 
-    text = main.get_text(separator="\n", strip=True)
+    text = "\n".join(t.strip() for t in main.itertext() if t.strip())
 
     # normalize excessive newlines
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _MULTI_NL.sub("\n\n", text)
 
     return {"text": text, "h1": h1}
 
 
+async def fetch_page_text(session: aiohttp.ClientSession, url: str) -> dict:
+    """
+    Download a page and extract clean text from main content container.
+    Network is awaited, parsing stays sync.
+    """
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        html = await resp.read()
+    return extract_page_text(html)
+
+
+async def crawl_all(pages: list[dict]) -> tuple[list[dict], list[str]]:
+    """
+    Crawl all pages concurrently (bounded by CONCURRENCY) and return
+    (corpus, errors). Corpus keeps the sidebar order.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    results: dict[str, dict] = {}
+    errors: list[str] = []
+
+    connector = aiohttp.TCPConnector(limit_per_host=CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={"User-Agent": USER_AGENT},
+    ) as session:
+        with Progress() as progress:
+            task = progress.add_task("[cyan]Crawling...[/]", total=len(pages))
+
+            async def crawl_one(page: dict):
+                async with semaphore:
+                    try:
+                        content = await fetch_page_text(session, page["url"])
+
+                        if not content["text"].strip():
+                            console.log(f"[yellow]SKIP empty:[/] {page['url']}")
+                        else:
+                            results[page["url"]] = {
+                                "url": page["url"],
+                                "title": content["h1"] or page["title"],
+                                "section": page["section"],
+                                "level": page["level"],
+                                "text": content["text"],
+                            }
+
+                    except Exception as exc:
+                        console.log(f"[red]ERROR:[/] {page['url']} → {exc}")
+                        errors.append(page["url"])
+
+                    finally:
+                        progress.advance(task)
+                        # stay polite: each slot waits before releasing
+                        await asyncio.sleep(DELAY)
+
+            await asyncio.gather(*(crawl_one(page) for page in pages))
+
+    corpus = [results[p["url"]] for p in pages if p["url"] in results]
+    return corpus, errors
+
+
+def stream_dump(path: Path, items: list[dict]):
+    """Write a JSON array one record at a time (no full-corpus string in memory)."""
+    with path.open("wb") as f:
+        f.write(b"[\n")
+        for i, item in enumerate(items):
+            if i:
+                f.write(b",\n")
+            f.write(orjson.dumps(item))
+        f.write(b"\n]\n")
+
+
 def main():
     console.print("\n[bold magenta]══ Crawl Agile Lab handbook ══[/]\n")
 
@@ -155,36 +234,11 @@ def main():
     console.print(preview_table)
     console.print()
 
-    corpus: list[dict] = []
-    errors: list[str] = []
-
-    # 2. crawl each page
-    for page in track(pages, description="[cyan]Crawling...[/]"):
-        try:
-            content = fetch_page_text(page["url"])
-
-            if not content["text"].strip():
-                console.log(f"[yellow]SKIP empty:[/] {page['url']}")
-                continue
-
-            corpus.append(
-                {
-                    "url": page["url"],
-                    "title": content["h1"] or page["title"],
-                    "section": page["section"],
-                    "level": page["level"],
-                    "text": content["text"],
-                }
-            )
-
-            time.sleep(DELAY)
-
-        except Exception as exc:
-            console.log(f"[red]ERROR:[/] {page['url']} → {exc}")
-            errors.append(page["url"])
+    # 2. crawl all pages concurrently
+    corpus, errors = asyncio.run(crawl_all(pages))
 
     # 3. save corpus
-    OUTPUT_PATH.write_text(json.dumps(corpus, indent=2, ensure_ascii=False))
+    stream_dump(OUTPUT_PATH, corpus)
 
     # 4. report
     size_kb = OUTPUT_PATH.stat().st_size / 1024
@@ -1,7 +1,11 @@
-import json
+import asyncio
+import hashlib
 import os
+import uuid
 from pathlib import Path
 
+import orjson
+import tiktoken
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_classic.schema import Document
@@ -18,9 +22,15 @@ CORPUS_PATH = Path("./data/corpus.json")
 CHROMA_DIR = os.getenv("CHROMA_PERSIST_DIR")
 COLLECTION_NAME = "agilelab_handbook"
 
-CHUNK_SIZE = 700
-CHUNK_OVERLAP = 100
-BATCH_SIZE = 100
+CHUNK_SIZE = 512  # tokens
+CHUNK_OVERLAP = 64  # tokens
+BATCH_SIZE = 100  # chunks per Chroma write
+QUEUE_SIZE = 3  # embedded batches waiting to be written (bounds memory)
+EMBED_BATCH_SIZE = 1000  # inputs per OpenAI embeddings request (API max 2048)
+EMBED_MAX_TOKENS = 290_000  # tokens per embeddings request (API max 300k)
+
+# text-embedding-3-small tokenizer, loaded once and reused by every length call
+ENCODING = tiktoken.get_encoding("cl100k_base")
 
 
 def load_corpus(path: Path) -> list[dict]:
@@ -29,7 +39,7 @@ def load_corpus(path: Path) -> list[dict]:
             f"❌ Corpus introuvable : {path}\n"
             "   Lance d'abord : uv run python step1_crawl.py"
         )
-    data = json.loads(path.read_text())
+    data = orjson.loads(path.read_bytes())
     console.log(f"[green]{len(data)} pages chargées depuis {path}[/]")
     return data
 
@@ -53,13 +63,17 @@ def build_documents(corpus: list[dict]) -> list[Document]:
     return docs
 
 
+def token_len(text: str) -> int:
+    return len(ENCODING.encode(text, disallowed_special=()))
+
+
 def chunk_documents(docs: list[Document]) -> list[Document]:
-    """Split documents into smaller chunks for embeddings."""
+    """Split documents into token-bounded chunks for embeddings."""
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", ".", " ", ""],
-        length_function=len,
+        length_function=token_len,
         add_start_index=True,
     )
     chunks = splitter.split_documents(docs)
@@ -73,36 +87,130 @@ def chunk_documents(docs: list[Document]) -> list[Document]:
     return chunks
 
 
+def token_batches(texts: list[str]) -> list[list[str]]:
+    """Pack texts into requests bounded by EMBED_MAX_TOKENS and EMBED_BATCH_SIZE."""
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        n_tokens = token_len(text)
+        if current and (
+            current_tokens + n_tokens > EMBED_MAX_TOKENS
+            or len(current) >= EMBED_BATCH_SIZE
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def dedup_texts(texts: list[str]) -> tuple[list[str], list[int]]:
+    """Return the distinct texts and, for each input text, its index among them."""
+    unique_index: dict[bytes, int] = {}
+    unique_texts: list[str] = []
+    order: list[int] = []
+    for text in texts:
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if key not in unique_index:
+            unique_index[key] = len(unique_texts)
+            unique_texts.append(text)
+        order.append(unique_index[key])
+    return unique_texts, order
+
+
+async def embed_worker(
+    embeddings: OpenAIEmbeddings, batches: list[list[str]], out_q: asyncio.Queue
+):
+    """Producer: embed each batch of unique texts and queue (offset, vectors)."""
+    offset = 0
+    for batch in batches:
+        vectors = await embeddings.aembed_documents(batch)
+        await out_q.put((offset, vectors))
+        offset += len(batch)
+    # Sentinel only on success : on failure the task group cancels the consumer
+    # (a put on the full queue would block forever once the consumer is gone)
+    await out_q.put(None)
+
+
+async def write_worker(
+    vectorstore: Chroma,
+    chunks: list[Document],
+    fan_out: dict[int, list[int]],
+    out_q: asyncio.Queue,
+    progress: Progress,
+    task,
+):
+    """Consumer: write every chunk sharing an embedded text while the next batch embeds."""
+    while (item := await out_q.get()) is not None:
+        offset, vectors = item
+        rows = [
+            (chunks[i], vector)
+            for u, vector in enumerate(vectors, start=offset)
+            for i in fan_out[u]
+        ]
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start : start + BATCH_SIZE]
+            # Chroma is sync → keep the event loop free for the next embedding request
+            await asyncio.to_thread(
+                vectorstore._collection.add,
+                ids=[str(uuid.uuid4()) for _ in batch],
+                documents=[c.page_content for c, _ in batch],
+                metadatas=[c.metadata for c, _ in batch],
+                embeddings=[v for _, v in batch],
+            )
+            progress.advance(task, advance=len(batch))
+
+
 def ingest_to_chroma(chunks: list[Document]) -> Chroma:
     """Generate embeddings and store them in Chroma."""
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        chunk_size=EMBED_BATCH_SIZE,
+        max_retries=6,
+    )
     vectorstore = Chroma(
         collection_name=COLLECTION_NAME,
         embedding_function=embeddings,
         persist_directory=CHROMA_DIR,
     )
 
-    # Clean existing data
-    existing = vectorstore.get()
-    if existing["ids"]:
+    # Clean existing data : drop + recreate the collection (no get() of every id)
+    console.log(f"[yellow]Réinitialisation de la collection {COLLECTION_NAME}...[/]")
+    vectorstore.reset_collection()
+
+    # Embed each distinct text once, fan the vector back out to every chunk
+    unique_texts, order = dedup_texts([c.page_content for c in chunks])
+    if len(unique_texts) < len(chunks):
         console.log(
-            f"[yellow]Suppression de {len(existing['ids'])} vecteurs existants...[/]"
+            f"[yellow]{len(chunks) - len(unique_texts)} chunks dupliqués ignorés à l'embedding[/]"
         )
-        vectorstore.delete(ids=existing["ids"])
+    fan_out: dict[int, list[int]] = {}
+    for i, u in enumerate(order):
+        fan_out.setdefault(u, []).append(i)
 
-    # Ingest in batches
+    # Pipeline : batch N is written to Chroma while batch N+1 is being embedded
     with Progress(
         TextColumn("[cyan]Embedding & stockage...[/]"),
         BarColumn(),
         MofNCompleteColumn(),
     ) as progress:
         task = progress.add_task("ingest", total=len(chunks))
-        for start in range(0, len(chunks), BATCH_SIZE):
-            batch = chunks[start : start + BATCH_SIZE]
-            texts = [c.page_content for c in batch]
-            metadatas = [c.metadata for c in batch]
-            vectorstore.add_texts(texts=texts, metadatas=metadatas)
-            progress.advance(task, advance=len(batch))
+
+        async def pipeline():
+            out_q: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+            # If either worker fails, the other is cancelled → no deadlock on out_q
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(
+                    embed_worker(embeddings, token_batches(unique_texts), out_q)
+                )
+                tg.create_task(
+                    write_worker(vectorstore, chunks, fan_out, out_q, progress, task)
+                )
+
+        asyncio.run(pipeline())
 
     console.print(
         f"[bold green]✅ {len(chunks)} chunks stockés dans Chroma → {CHROMA_DIR}[/]"
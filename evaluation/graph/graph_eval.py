@@ -1,12 +1,12 @@
+import csv
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 import mlflow
-import pandas as pd
 from dotenv import load_dotenv
 from langchain_core.documents import Document
-from langchain_core.messages import HumanMessage
 from rich.console import Console
 
 from evaluation.graph.graph_structure_eval import GraphStructureEvaluator
@@ -16,6 +16,37 @@ from evaluation.graph.nodes import (CLASSIFY_CASES, GRADE_CASES,
 load_dotenv()
 console = Console()
 
+MAX_WORKERS = 8  # cas évalués en parallèle (appels LLM I/O-bound)
+
+# Nœuds lancés ensemble depuis START (même super-step) : leur ordre d'arrivée dans
+# le stream varie d'un run à l'autre
+START_FANOUT = frozenset({"classify", "retrieve"})
+
+
+def _report_accuracy(rows: list[dict]) -> float:
+    """Affiche et retourne l'accuracy d'une liste de rows (clé "pass")."""
+    n_pass = sum(1 for row in rows if row["pass"])
+    acc = n_pass / len(rows) if rows else 0.0
+    console.print(f"\n  Accuracy : [bold]{acc:.1%}[/]  ({n_pass}/{len(rows)})")
+    return acc
+
+
+def _canonical_path(path: list[str]) -> list:
+    """Chemin comparable : le super-step de START en ensemble, la suite dans l'ordre."""
+    n = 0
+    while n < len(path) and path[n] in START_FANOUT:
+        n += 1
+    return [frozenset(path[:n]), *path[n:]]
+
+
+def _write_csv(path: Path, rows: list[dict]):
+    with open(path, "w", newline="") as f:
+        if not rows:
+            return
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
 
 class GraphEvaluator:
     """
@@ -24,180 +55,183 @@ class GraphEvaluator:
     Évals disponibles :
       1. classify   → retourne-t-il le bon intent ?
       2. retrieve   → récupère-t-il des docs pertinents ?
-      3. grade      → évalue-t-il correctement la pertinence ?
+      3. grade      → generate évalue-t-il correctement la pertinence ?
       4. routing    → le graph prend-il le bon chemin ?
       5. structure  → évalue la structure globale du graph
 
     Capture des états intermédiaires via agent.graph.stream(stream_mode="updates").
+    Chaque input n'est exécuté qu'une fois : classify, retrieve et routing
+    lisent le même run (snapshot + chemin).
     """
 
-    def __init__(self, agent, graph_struct_config):
+    def __init__(self, agent, graph_struct_config, max_workers: int = MAX_WORKERS):
         self.agent = agent
+        self.max_workers = max_workers
         self.struct_eval = GraphStructureEvaluator(agent, graph_struct_config)
+        # input → (snapshot, path) : un seul run du graph par question
+        self._runs: dict[str, tuple[dict, list[str]]] = {}
 
     # ── PRIVATE ────────────────────────────────────────────────
-    def _stream_graph(self, question: str, thread_id: str) -> dict:
-        """Exécute le graph et capture les snapshots par nœud."""
-        config = {"configurable": {"thread_id": thread_id}}
+    def _stream_graph(self, question: str, thread_id: str) -> tuple[dict, list[str]]:
+        """Exécute le graph et capture les snapshots par nœud + le chemin suivi."""
+        config = self.agent._config(thread_id)
         snapshot = {}
+        path = []
 
         for update in self.agent.graph.stream(
-            {"messages": [HumanMessage(content=question)], "source": "handbook"},
+            {**self.agent._input(question), "source": "handbook"},
             config=config,
             stream_mode="updates",
         ):
             for node_name, node_output in update.items():
                 snapshot[node_name] = node_output
+                path.append(node_name)
 
-        return snapshot
-
-    def _eval_classify(self) -> pd.DataFrame:
-        console.print(
-            "\n[cyan]── Éval nœud : classify ─────────────────────────────[/]"
-        )
-        rows = []
-        for i, tc in enumerate(CLASSIFY_CASES):
-            snapshot = self._stream_graph(tc["input"], thread_id=f"eval-cls-{i}")
-            actual_intent = snapshot.get("classify", {}).get("intent", "MISSING")
-            expected_intent = tc["expected_intent"]
-            passed = actual_intent == expected_intent
+        return snapshot, path
 
+    def _prefetch_runs(self):
+        """Exécute le graph une seule fois par input unique (en parallèle)."""
+        inputs = [
+            tc["input"] for tc in (*CLASSIFY_CASES, *RETRIEVE_CASES, *ROUTING_CASES)
+        ]
+        pending = [q for q in dict.fromkeys(inputs) if q not in self._runs]
+        if len(pending) < len(inputs):
             console.print(
-                f"  {'✅' if passed else '❌'} [{actual_intent:<16}] {tc['input'][:55]}"
+                f"[dim]  {len(inputs) - len(pending)} inputs partagés entre évals → réutilisés[/]"
             )
-            if not passed:
-                console.print(f"       [red]→ attendu : {expected_intent}[/]")
 
-            rows.append(
-                {
-                    "input": tc["input"],
-                    "expected_intent": expected_intent,
-                    "actual_intent": actual_intent,
-                    "pass": passed,
-                }
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            runs = pool.map(
+                lambda iq: self._stream_graph(iq[1], thread_id=f"eval-run-{iq[0]}"),
+                enumerate(pending),
             )
-        df = pd.DataFrame(rows)
+            self._runs.update(zip(pending, runs))
+
+    def _graph_run(self, question: str) -> tuple[dict, list[str]]:
+        if question not in self._runs:
+            self._prefetch_runs()
+        return self._runs[question]
+
+    def _map_cases(self, fn, cases: list[dict]) -> list[dict]:
+        """Exécute fn(i, tc) sur chaque cas en parallèle, dans l'ordre d'origine."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(fn, range(len(cases)), cases))
+
+    def _run_one_classify(self, i: int, tc: dict) -> dict:
+        snapshot, _ = self._graph_run(tc["input"])
+        actual_intent = snapshot.get("classify", {}).get("intent", "MISSING")
+        expected_intent = tc["expected_intent"]
+        return {
+            "input": tc["input"],
+            "expected_intent": expected_intent,
+            "actual_intent": actual_intent,
+            "pass": actual_intent == expected_intent,
+        }
+
+    def _eval_classify(self) -> tuple[float, list[dict]]:
         console.print(
-            f"\n  Accuracy : [bold]{df['pass'].mean():.1%}[/]  ({df['pass'].sum()}/{len(df)})"
+            "\n[cyan]── Éval nœud : classify ─────────────────────────────[/]"
         )
-        return df
+        rows = self._map_cases(self._run_one_classify, CLASSIFY_CASES)
+        for row in rows:
+            console.print(
+                f"  {'✅' if row['pass'] else '❌'} [{row['actual_intent']:<16}] {row['input'][:55]}"
+            )
+            if not row["pass"]:
+                console.print(f"       [red]→ attendu : {row['expected_intent']}[/]")
+
+        return _report_accuracy(rows), rows
+
+    def _run_one_retrieve(self, i: int, tc: dict) -> dict:
+        snapshot, _ = self._graph_run(tc["input"])
+        documents = snapshot.get("retrieve", {}).get("documents", [])
+
+        # docs mis en minuscules une seule fois ; chaque keyword cherché séparément
+        # (une alternation regex consomme ses matches → "day off" masquait "off work")
+        contents = [
+            (doc.page_content if isinstance(doc, Document) else str(doc)).lower()
+            for doc in documents
+        ]
+        keywords_found = [
+            kw
+            for kw in tc["relevant_keywords"]
+            if any(kw.lower() in content for content in contents)
+        ]
+        return {
+            "input": tc["input"],
+            "n_docs_retrieved": len(documents),
+            "keywords_found": ", ".join(keywords_found),
+            "pass": len(keywords_found) > 0,
+        }
 
-    def _eval_retrieve(self) -> pd.DataFrame:
+    def _eval_retrieve(self) -> tuple[float, list[dict]]:
         console.print(
             "\n[cyan]── Éval nœud : retrieve ─────────────────────────────[/]"
         )
-        rows = []
-        for i, tc in enumerate(RETRIEVE_CASES):
-            snapshot = self._stream_graph(tc["input"], thread_id=f"eval-ret-{i}")
-            documents = snapshot.get("retrieve", {}).get("documents", [])
-            n_docs = len(documents)
-
-            all_content = " ".join(
-                (
-                    doc.page_content.lower()
-                    if isinstance(doc, Document)
-                    else str(doc).lower()
-                )
-                for doc in documents
-            )
-            keywords_found = [
-                kw for kw in tc["relevant_keywords"] if kw.lower() in all_content
-            ]
-            passed = len(keywords_found) > 0
-
+        rows = self._map_cases(self._run_one_retrieve, RETRIEVE_CASES)
+        for row in rows:
             console.print(
-                f"  {'✅' if passed else '❌'} {n_docs} docs  keywords={keywords_found or '∅'}  {tc['input'][:45]}"
+                f"  {'✅' if row['pass'] else '❌'} {row['n_docs_retrieved']} docs  keywords={row['keywords_found'] or '∅'}  {row['input'][:45]}"
             )
-            rows.append(
-                {
-                    "input": tc["input"],
-                    "n_docs_retrieved": n_docs,
-                    "keywords_found": ", ".join(keywords_found),
-                    "pass": passed,
-                }
-            )
-        df = pd.DataFrame(rows)
-        console.print(
-            f"\n  Accuracy : [bold]{df['pass'].mean():.1%}[/]  ({df['pass'].sum()}/{len(df)})"
-        )
-        return df
 
-    def _eval_grade(self) -> pd.DataFrame:
+        return _report_accuracy(rows), rows
+
+    def _run_one_grade(self, i: int, tc: dict) -> dict:
+        state = {
+            **self.agent._input(tc["input"]),
+            "documents": [Document(page_content=d) for d in tc["documents"]],
+        }
+        # la pertinence est jugée par le nœud generate (grade fusionné)
+        result = self.agent._generate(state)
+        actual = result.get("relevant", None)
+        expected = tc["expected_relevant"]
+        return {
+            "input": tc["input"],
+            "document_preview": tc["documents"][0][:80],
+            "expected_relevant": expected,
+            "actual_relevant": actual,
+            "pass": actual == expected,
+        }
+
+    def _eval_grade(self) -> tuple[float, list[dict]]:
         console.print(
             "\n[cyan]── Éval nœud : grade ────────────────────────────────[/]"
         )
-        rows = []
-        for i, tc in enumerate(GRADE_CASES):
-            state = {
-                "messages": [HumanMessage(content=tc["input"])],
-                "documents": [Document(page_content=d) for d in tc["documents"]],
-            }
-            result = self.agent._grade(state)
-            actual = result.get("relevant", None)
-            expected = tc["expected_relevant"]
-            passed = actual == expected
-
-            doc_preview = tc["documents"][0][:60] + "..."
+        rows = self._map_cases(self._run_one_grade, GRADE_CASES)
+        for row in rows:
+            doc_preview = row["document_preview"][:60] + "..."
             console.print(
-                f"  {'✅' if passed else '❌'} relevant={str(actual):<6} (attendu={expected})  {doc_preview}"
+                f"  {'✅' if row['pass'] else '❌'} relevant={str(row['actual_relevant']):<6} (attendu={row['expected_relevant']})  {doc_preview}"
             )
 
-            rows.append(
-                {
-                    "input": tc["input"],
-                    "document_preview": tc["documents"][0][:80],
-                    "expected_relevant": expected,
-                    "actual_relevant": actual,
-                    "pass": passed,
-                }
-            )
-        df = pd.DataFrame(rows)
-        console.print(
-            f"\n  Accuracy : [bold]{df['pass'].mean():.1%}[/]  ({df['pass'].sum()}/{len(df)})"
-        )
-        return df
+        return _report_accuracy(rows), rows
+
+    def _run_one_routing(self, i: int, tc: dict) -> dict:
+        _, actual_path = self._graph_run(tc["input"])
+
+        expected_path = tc["expected_path"]
+        return {
+            "input": tc["input"],
+            "description": tc["description"],
+            "expected_path": " → ".join(expected_path),
+            "actual_path": " → ".join(actual_path),
+            "pass": _canonical_path(actual_path) == _canonical_path(expected_path),
+        }
 
-    def _eval_routing(self) -> pd.DataFrame:
+    def _eval_routing(self) -> tuple[float, list[dict]]:
         console.print(
             "\n[cyan]── Éval nœud : routing ──────────────────────────────[/]"
         )
-        rows = []
-        for i, tc in enumerate(ROUTING_CASES):
-            config = {"configurable": {"thread_id": f"eval-route-{i}"}}
-            actual_path = []
-
-            for update in self.agent.graph.stream(
-                {"messages": [HumanMessage(content=tc["input"])], "source": "handbook"},
-                config=config,
-                stream_mode="updates",
-            ):
-                for node_name in update.keys():
-                    actual_path.append(node_name)
-
-            expected_path = tc["expected_path"]
-            passed = actual_path == expected_path
-
-            console.print(f"  {'✅' if passed else '❌'} {tc['description']}")
-            console.print(f"       attendu : {' → '.join(expected_path)}")
-            if not passed:
-                console.print(f"       [red]obtenu  : {' → '.join(actual_path)}[/]")
+        rows = self._map_cases(self._run_one_routing, ROUTING_CASES)
+        for row in rows:
+            console.print(f"  {'✅' if row['pass'] else '❌'} {row['description']}")
+            console.print(f"       attendu : {row['expected_path']}")
+            if not row["pass"]:
+                console.print(f"       [red]obtenu  : {row['actual_path']}[/]")
             else:
-                console.print(f"       obtenu  : {' → '.join(actual_path)}")
+                console.print(f"       obtenu  : {row['actual_path']}")
 
-            rows.append(
-                {
-                    "input": tc["input"],
-                    "description": tc["description"],
-                    "expected_path": " → ".join(expected_path),
-                    "actual_path": " → ".join(actual_path),
-                    "pass": passed,
-                }
-            )
-        df = pd.DataFrame(rows)
-        console.print(
-            f"\n  Accuracy : [bold]{df['pass'].mean():.1%}[/]  ({df['pass'].sum()}/{len(df)})"
-        )
-        return df
+        return _report_accuracy(rows), rows
 
     # ── PUBLIC ───────────────────────────────────────────────
     def run_graph_evaluation(self) -> dict:
@@ -208,15 +242,11 @@ class GraphEvaluator:
             run_name=f"GraphEval_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         ) as run:
             struct = self.struct_eval.eval_structured()
-            cls_df = self._eval_classify()
-            ret_df = self._eval_retrieve()
-            grd_df = self._eval_grade()
-            rout_df = self._eval_routing()
-
-            acc_classify = cls_df["pass"].mean()
-            acc_retrieve = ret_df["pass"].mean()
-            acc_grade = grd_df["pass"].mean()
-            acc_routing = rout_df["pass"].mean()
+            self._prefetch_runs()
+            acc_classify, cls_rows = self._eval_classify()
+            acc_retrieve, ret_rows = self._eval_retrieve()
+            acc_grade, grd_rows = self._eval_grade()
+            acc_routing, rout_rows = self._eval_routing()
             structure_ok = int(struct["all_ok"])
             graph_score = (
                 acc_classify + acc_retrieve + acc_grade + acc_routing + structure_ok
@@ -243,10 +273,10 @@ class GraphEvaluator:
 
             # Export CSV
             tmp_dir = Path("evaluation/data/graph/outputs/")
-            cls_df.to_csv(tmp_dir / "eval_classify.csv", index=False)
-            ret_df.to_csv(tmp_dir / "eval_retrieve.csv", index=False)
-            grd_df.to_csv(tmp_dir / "eval_grade.csv", index=False)
-            rout_df.to_csv(tmp_dir / "eval_routing.csv", index=False)
+            _write_csv(tmp_dir / "eval_classify.csv", cls_rows)
+            _write_csv(tmp_dir / "eval_retrieve.csv", ret_rows)
+            _write_csv(tmp_dir / "eval_grade.csv", grd_rows)
+            _write_csv(tmp_dir / "eval_routing.csv", rout_rows)
             mlflow.log_artifacts(tmp_dir, artifact_path="node_results")
 
             # Résumé console
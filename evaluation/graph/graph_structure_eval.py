@@ -1,9 +1,15 @@
+from functools import cached_property
 from pathlib import Path
 
 import mlflow
 import yaml
 from rich.console import Console
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
 from src.agent.agent import HandbookAgent
 
 console = Console()
@@ -27,24 +33,41 @@ class GraphStructureEvaluator:
     def _load_and_build_expected(self) -> dict:
         """Charge le YAML et construit la structure attendue exploitable."""
         with open(self.yaml_path) as f:
-            cfg = yaml.safe_load(f)
+            cfg = yaml.load(f, Loader=SafeLoader)
 
         return {
-            "nodes": set(cfg["nodes"]["expected"]),
+            "nodes": frozenset(cfg["nodes"]["expected"]),
             "n_nodes": cfg["nodes"]["count"],
             "n_tool_nodes": cfg["tool_nodes"]["count"],
-            "direct_edges": {tuple(e) for e in cfg["direct_edges"]},
+            "direct_edges": frozenset(tuple(e) for e in cfg["direct_edges"]),
             "conditional_edges": cfg["conditional_edges"],
         }
 
+    @cached_property
+    def _graph(self):
+        """Graph dessinable de l'agent, calculé une seule fois."""
+        return self.agent.graph.get_graph()
+
+    @staticmethod
+    def _is_tool_node(name: str, node) -> bool:
+        return "tool" in name.lower() or (
+            hasattr(node, "data") and "ToolNode" in type(node.data).__name__
+        )
+
     def _eval_structure(self) -> dict:
         """Compare la structure réelle du graph avec celle attendue."""
         console.print(
             "\n[cyan]── Éval structure du graph ──────────────────────────[/]"
         )
 
-        g = self.agent.graph.get_graph()
-        actual_nodes = set(g.nodes.keys()) - {"__start__", "__end__"}
+        g = self._graph
+        # une seule passe sur les nœuds : noms + détection des ToolNodes
+        actual_nodes = set()
+        n_tool = 0
+        for name, node in g.nodes.items():
+            if name not in ("__start__", "__end__"):
+                actual_nodes.add(name)
+            n_tool += self._is_tool_node(name, node)
         actual_edges = {(e.source, e.target) for e in g.edges}
         checks = {}
 
@@ -60,12 +83,6 @@ class GraphStructureEvaluator:
         )
 
         # 2. ToolNodes
-        n_tool = sum(
-            1
-            for name, node in g.nodes.items()
-            if "tool" in name.lower()
-            or (hasattr(node, "data") and "ToolNode" in type(node.data).__name__)
-        )
         tool_ok = n_tool == self.expected["n_tool_nodes"]
         checks["tool_node_count"] = (
             tool_ok,
@@ -1,12 +1,19 @@
+from functools import lru_cache
 from pathlib import Path
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
 
+
+@lru_cache(maxsize=1)
 def load_node_cases() -> dict:
     path = Path(__file__).parents[1] / "data/graph/inputs/nodes.yaml"
     with open(path) as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 
 _data = load_node_cases()
@@ -1,4 +1,4 @@
-import time
+import asyncio
 from datetime import datetime
 
 import mlflow
@@ -7,12 +7,15 @@ from dotenv import load_dotenv
 from rich.console import Console
 
 from evaluation.lash.lash_metrics import (ALL_SCORERS, PASS_THRESHOLDS,
-                                          WEIGHTS, latency_to_score)
+                                          WEIGHTS, latency_to_scores)
 from src.agent.agent import HandbookAgent
 
 load_dotenv()
 console = Console()
 
+MAX_CONCURRENCY = 8  # test cases exécutés en parallèle (appels LLM I/O-bound)
+COLLECT_COLUMNS = ["inputs", "expectations", "answer", "latency", "cached", "category"]
+
 
 class LashEvaluator:
     """
@@ -27,51 +30,82 @@ class LashEvaluator:
         self.agent = agent
         self.test_cases = test_cases
         self.df = pd.DataFrame()
+        self._eval_data: list[dict] = []
 
     # ══════════════════════════════════════════════════════════════════════════
     # PHASE 1 — COLLECT
     # ══════════════════════════════════════════════════════════════════════════
 
-    def collect(self) -> pd.DataFrame:
-        """Exécute toutes les questions et collecte les réponses + latences."""
+    async def acollect(self) -> pd.DataFrame:
+        """Exécute toutes les questions en parallèle et collecte les réponses + latences."""
         console.print(
             f"\n[bold cyan]── Phase 1 : Collecte ({len(self.test_cases)} test cases) ──────────────[/]"
         )
 
-        rows = []
-        for i, tc in enumerate(self.test_cases):
-            label = tc["input"][:55] + "..." if len(tc["input"]) > 55 else tc["input"]
-            console.print(f"  [{i+1:02d}/{len(self.test_cases)}] {label}")
-
-            start = time.time()
-            answer, _ = self.agent(tc["input"], thread_id=f"eval-{i}")
-            latency = time.time() - start
-            l_score = latency_to_score(latency)
-
-            console.print(
-                f"         latency=[bold]{latency:.2f}s[/]  L_score={l_score:.2f}"
-            )
-            console.print(
-                f"         answer : {answer[:80]}{'...' if len(answer) > 80 else ''}"
-            )
-
-            rows.append(
-                {
-                    "inputs": tc["input"],
-                    "expectations": tc["expected"],
-                    "answer": answer,
-                    "latency": latency,
-                    "l_score": l_score,
-                    "category": tc.get("category", "unknown"),
-                }
-            )
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        loop = asyncio.get_running_loop()
+
+        async def _one(i: int, tc: dict) -> dict:
+            async with semaphore:
+                # Réponse servie par l'AgentCache → latence d'une lecture SQLite, non
+                # représentative : ligne exclue du score L
+                cached = self.agent.is_cached(tc["input"], thread_id=f"eval-{i}")
+                start = loop.time()
+                answer, _ = await self.agent.ainvoke(tc["input"], thread_id=f"eval-{i}")
+                latency = loop.time() - start
+
+            return {
+                "inputs": tc["input"],
+                "expectations": tc["expected"],
+                "answer": answer,
+                "latency": latency,
+                "cached": cached,
+                "category": tc.get("category", "unknown"),
+            }
+
+        rows = await asyncio.gather(
+            *(asyncio.create_task(_one(i, tc)) for i, tc in enumerate(self.test_cases))
+        )
 
-        self.df = pd.DataFrame(rows)
-        console.print(f"\n  ✅ {len(self.df)} réponses collectées")
-        console.print(f"  Latency moyenne : {self.df['latency'].mean():.2f}s")
-        console.print(f"  L score moyen   : {self.df['l_score'].mean():.3f}")
+        self.df = pd.DataFrame.from_records(rows, columns=COLLECT_COLUMNS)
+        # Entrée de mlflow.genai.evaluate construite une fois, directement depuis les rows
+        self._eval_data = [
+            {
+                "inputs": {"question": r["inputs"]},
+                "outputs": r["answer"],
+                "expectations": {"expected_response": r["expectations"]},
+            }
+            for r in rows
+        ]
+        # Score L calculé en une fois sur toute la colonne (NaN pour les hits de cache)
+        self.df["l_score"] = latency_to_scores(self.df["latency"].to_numpy())
+        self.df["l_score"] = self.df["l_score"].mask(self.df["cached"])
+
+        # Logs bufferisés puis affichés en un seul appel, dans l'ordre des test cases
+        n = len(self.test_cases)
+        logs = []
+        for i, (q, answer, latency, cached, l_score) in enumerate(
+            self.df[["inputs", "answer", "latency", "cached", "l_score"]].itertuples(index=False)
+        ):
+            label = q[:55] + "..." if len(q) > 55 else q
+            timing = "[dim]cache (hors score L)[/]" if cached else f"L_score={l_score:.2f}"
+            logs += [
+                f"  [{i+1:02d}/{n}] {label}",
+                f"         latency=[bold]{latency:.2f}s[/]  {timing}",
+                f"         answer : {answer[:80]}{'...' if len(answer) > 80 else ''}",
+            ]
+        measured = self.df.loc[~self.df["cached"]]
+        logs += [
+            f"\n  ✅ {len(self.df)} réponses collectées ({len(self.df) - len(measured)} en cache)",
+            f"  Latency moyenne : {measured['latency'].mean():.2f}s",
+            f"  L score moyen   : {measured['l_score'].mean():.3f}",
+        ]
+        console.print("\n".join(logs))
         return self.df
 
+    def collect(self) -> pd.DataFrame:
+        return asyncio.run(self.acollect())
+
     # ══════════════════════════════════════════════════════════════════════════
     # PHASE 2 — MLFLOW EVALUATE
     # ══════════════════════════════════════════════════════════════════════════
@@ -82,12 +116,6 @@ class LashEvaluator:
                 "DataFrame vide — appeler collect() avant _run_evaluation()"
             )
 
-        def predict_fn(question: str) -> str:
-            row = self.df.loc[self.df["inputs"] == question]
-            if not row.empty:
-                return row.iloc[0]["answer"]
-            return self.agent(question)[0]
-
         console.print(
             f"\n[bold cyan]── Phase 2 : mlflow.genai.evaluate() ───────────────────[/]"
         )
@@ -99,17 +127,10 @@ class LashEvaluator:
         run_name = f"LASH_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
         with mlflow.start_run(run_name=run_name) as run:
+            # Réponses déjà collectées en phase 1 → passées en "outputs",
+            # mlflow n'appelle plus l'agent ligne par ligne (pas de predict_fn)
             results = mlflow.genai.evaluate(
-                data=[
-                    {
-                        "inputs": {"question": r["inputs"]},
-                        "expectations": {"expected_response": r["expectations"]},
-                    }
-                    for r in self.df[["inputs", "expectations"]].to_dict(
-                        orient="records"
-                    )
-                ],
-                predict_fn=predict_fn,
+                data=self._eval_data,
                 scorers=ALL_SCORERS,
             )
 
@@ -119,21 +140,23 @@ class LashEvaluator:
             )
 
             m = results.metrics
-            mean_L = self.df["l_score"].mean()
+            mean_L = self.df["l_score"].mean()  # hits de cache (NaN) ignorés
             mean_A = m.get("correctness/mean")
             mean_S = m.get("safety/mean")
             mean_H = m.get("helpfulness/mean")
 
-            mean_lash = (
-                mean_L * WEIGHTS["latency"]
-                + mean_A * WEIGHTS["correctness"]
-                + mean_S * WEIGHTS["safety"]
-                + mean_H * WEIGHTS["helpfulness"]
+            # Toutes les réponses en cache → L non mesuré : LASH pondéré sur A, S, H
+            latency_measured = not pd.isna(mean_L)
+            scores = {"correctness": mean_A, "safety": mean_S, "helpfulness": mean_H}
+            if latency_measured:
+                scores["latency"] = mean_L
+            mean_lash = sum(WEIGHTS[k] * v for k, v in scores.items()) / sum(
+                WEIGHTS[k] for k in scores
             )
 
             lash_pass = all(
                 [
-                    mean_L >= PASS_THRESHOLDS["latency"],
+                    not latency_measured or mean_L >= PASS_THRESHOLDS["latency"],
                     mean_A >= PASS_THRESHOLDS["correctness"],
                     mean_S >= PASS_THRESHOLDS["safety"],
                     mean_H >= PASS_THRESHOLDS["helpfulness"],
@@ -144,12 +167,13 @@ class LashEvaluator:
             # ── Log MLflow ────────────────────────────────────────────────
             mlflow.log_metrics(
                 {
-                    "mean_latency_score": mean_L,
+                    **({"mean_latency_score": mean_L} if latency_measured else {}),
                     "mean_correctness_score": mean_A,
                     "mean_safety_score": mean_S,
                     "mean_helpfulness_score": mean_H,
                     "mean_lash_score": mean_lash,
                     "lash_pass": int(lash_pass),
+                    "cached_answers": int(self.df["cached"].sum()),
                 }
             )
 
@@ -168,6 +192,9 @@ class LashEvaluator:
                 ("H", WEIGHTS["helpfulness"], mean_H, PASS_THRESHOLDS["helpfulness"]),
             ]
             for dim, weight, score, threshold in dims:
+                if pd.isna(score):
+                    console.print(f"  {dim:<6} {weight:<8.2f} {'—':<8} (réponses en cache)")
+                    continue
                 icon = "✅" if score >= threshold else "❌"
                 console.print(
                     f"  {dim:<6} {weight:<8.2f} {score:<8.3f} ≥ {threshold:<10.2f} {icon}"
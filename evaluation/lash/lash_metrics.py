@@ -1,5 +1,6 @@
 import time
 
+import numpy as np
 from mlflow.entities import Feedback
 from mlflow.genai.scorers import Correctness, Guidelines, Safety, scorer
 
@@ -49,6 +50,22 @@ def latency_to_score(latency: float) -> float:
         return max(0.0, 0.5 - (latency - NEUTRAL) / 10.0)
 
 
+def latency_to_scores(latencies: np.ndarray) -> np.ndarray:
+    """Version vectorisée de latency_to_score sur un tableau de latences."""
+    GOOD = LATENCY_THRESHOLDS["good"]
+    NEUTRAL = LATENCY_THRESHOLDS["neutral"]
+    lat = np.asarray(latencies, dtype=float)
+    return np.where(
+        lat < GOOD,
+        1.0,
+        np.where(
+            lat < NEUTRAL,
+            1.0 - (lat - GOOD) / (NEUTRAL - GOOD) * 0.5,
+            np.maximum(0.0, 0.5 - (lat - NEUTRAL) / 10.0),
+        ),
+    )
+
+
 @scorer
 def latency_ok(inputs: dict) -> Feedback:
     """
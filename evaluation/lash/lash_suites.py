@@ -2,12 +2,17 @@ from pathlib import Path
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
 
 def load_test_cases() -> list[dict]:
 
     path = Path(__file__).parents[1] / "data/lash/inputs/lash_suites.yaml"
     with open(path) as f:
-        data = yaml.safe_load(f)
+        data = yaml.load(f, Loader=SafeLoader)
     return [
         {**case, "category": category}
         for category, cases in data.items()
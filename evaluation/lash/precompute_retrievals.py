@@ -0,0 +1,73 @@
+"""
+Précalcule le retrieval des questions d'éval (LASH + nœuds) une fois pour toutes.
+
+Lancer avec :
+    uv run python -m evaluation.lash.precompute_retrievals
+
+Le fichier produit est chargé par evaluation/main.py : l'agent saute alors
+l'embedding + la recherche Chroma pour ces questions.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from rich.console import Console
+
+from evaluation.graph.nodes import (CLASSIFY_CASES, RETRIEVE_CASES,
+                                    ROUTING_CASES)
+from evaluation.lash.lash_suites import LASH_TEST_CASES
+from src.agent.agent import (COLLECTION_NAME, EMBEDDING_MODEL, RETRIEVE_K,
+                             HandbookAgent)
+from src.agent.cache import DEFAULT_EMBEDDINGS_CACHE_PATH
+
+load_dotenv()
+console = Console()
+
+RETRIEVAL_CACHE_PATH = (
+    Path(__file__).parents[1] / "data/lash/retrieval_cache.json"
+)
+
+
+def main():
+    llm = ChatOpenAI(model=os.getenv("MODEL_NAME", "gpt-4o-mini"), temperature=0)
+    agent = HandbookAgent(model=llm, embeddings_cache=DEFAULT_EMBEDDINGS_CACHE_PATH)
+
+    questions = list(
+        dict.fromkeys(
+            tc["input"]
+            for tc in (*LASH_TEST_CASES, *CLASSIFY_CASES, *RETRIEVE_CASES, *ROUTING_CASES)
+        )
+    )
+
+    entries = {}
+    for q in questions:
+        results = agent.vectorstore.similarity_search_with_relevance_scores(
+            q, k=RETRIEVE_K
+        )
+        entries[q] = {
+            "doc_ids": [doc.id for doc, _ in results],
+            "scores": [score for _, score in results],
+        }
+        console.print(f"  ✅ {len(results)} docs  {q[:60]}")
+
+    RETRIEVAL_CACHE_PATH.write_text(
+        json.dumps(
+            {
+                "collection": COLLECTION_NAME,
+                "embedding_model": EMBEDDING_MODEL,
+                "entries": entries,
+            },
+            indent=2,
+            ensure_ascii=False,
+        )
+    )
+    console.print(
+        f"\n[bold green]{len(entries)} retrievals → {RETRIEVAL_CACHE_PATH}[/]"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 import os
 from pathlib import Path
 
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from rich.console import Console
@@ -10,19 +11,50 @@ from evaluation.graph.graph_eval import GraphEvaluator
 # Import your evaluators
 from evaluation.lash.lash_evaluate import LashEvaluator
 from evaluation.lash.lash_suites import LASH_TEST_CASES
-from src.agent.agent import HandbookAgent
+from evaluation.lash.precompute_retrievals import RETRIEVAL_CACHE_PATH
+from src.agent.agent import HandbookAgent, load_retrieval_cache
+from src.agent.cache import DEFAULT_EMBEDDINGS_CACHE_PATH, AgentCache
 
 load_dotenv()
 console = Console()
 
+# Pool de connexions partagé par le LLM et les embeddings sur toute l'éval
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+HTTP_TIMEOUT = 60.0
+
+# Phase 2 LASH : mlflow.genai.evaluate juge les lignes dans un pool de threads
+# (MLFLOW_GENAI_EVAL_MAX_WORKERS, 10 par défaut) ; les scorers d'une ligne sont déjà
+# tous parallélisés par défaut (min(nb scorers, 10))
+JUDGE_ROW_WORKERS = 16
+
 
 def main():
+    # lu par MLflow au moment de l'évaluation → posé ici, pas à l'import des modules d'éval
+    os.environ.setdefault("MLFLOW_GENAI_EVAL_MAX_WORKERS", str(JUDGE_ROW_WORKERS))
     graph_struct_config = Path(__file__).resolve().parent / "graph_structure.yaml"
 
     # ── Init LLM and Agent ──────────────────────────────
     model_name = os.getenv("MODEL_NAME", "gpt-4o-mini")
-    llm = ChatOpenAI(model=model_name, temperature=0)
-    agent = HandbookAgent(model=llm)
+    http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    llm = ChatOpenAI(
+        model=model_name,
+        temperature=0,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+    # Cache persistant des réponses (optionnel) → reruns d'éval quasi gratuits
+    cache_path = os.getenv("AGENT_CACHE_PATH")
+    agent = HandbookAgent(
+        model=llm,
+        cache=AgentCache(cache_path) if cache_path else None,
+        # questions fixes d'une exécution à l'autre → embeddings relus depuis le disque
+        embeddings_cache=DEFAULT_EMBEDDINGS_CACHE_PATH,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        # retrieval précalculé (python -m evaluation.lash.precompute_retrievals)
+        retrieval_cache=load_retrieval_cache(RETRIEVAL_CACHE_PATH),
+    )
 
     console.print(
         "\n[bold cyan]╔═════════════════════════════════════════════════════════════════════════════╗[/]"
@@ -1,23 +1,38 @@
+import asyncio
+import hashlib
+import json
+import math
 import os
-from typing import Annotated, List, Literal, TypedDict
-
-from deep_translator import GoogleTranslator
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Annotated, AsyncIterator, List, Literal, TypedDict
+
+import tiktoken
+import yaml
+from chromadb.config import Settings
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from langchain_core.messages import (AIMessage, BaseMessage, HumanMessage,
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage,
+                                     HumanMessage, RemoveMessage,
                                      SystemMessage)
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_openai import OpenAIEmbeddings
-from langdetect import DetectorFactory
-from langdetect import detect as ld_detect
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from pydantic import BaseModel, Field
 
-# On fixe le seed pour la reproductibilité de langdetect
-DetectorFactory.seed = 0
+from src.agent.cache import AgentCache, CachedEmbeddings
+from src.agent.checkpoint import BoundedMemorySaver
+from src.agent.semantic_cache import SemanticCache
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
 
 load_dotenv()
 
@@ -26,15 +41,116 @@ load_dotenv()
 CHROMA_DIR = os.getenv("CHROMA_PERSIST_DIR")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME")
 
-OFF_TOPIC_REPLY = (
-    "I can only answer questions about the Agile Lab company handbook. "
-    "Please ask me about Agile Lab's policies, culture, benefits, or engineering practices."
-)
+EMBEDDING_MODEL = "text-embedding-3-small"
+RETRIEVE_K = 5
+
+# Seuils sur le meilleur score de pertinence Chroma, exprimés en cosinus.
+# Espace "l2" par défaut de la collection = L2 au carré : d = 2 - 2·cos sur embeddings
+# normalisés, que langchain_chroma convertit en relevance = 1 - d/√2 = 1 - √2·(1 - cos).
+# Au-dessus / en dessous → verdict direct, entre les deux → jugé par le LLM de generate.
+RELEVANCE_HIGH_COS = 0.75
+RELEVANCE_LOW_COS = 0.28
+
+
+def _relevance_from_cos(cos: float) -> float:
+    return 1 - math.sqrt(2) * (1 - cos)
+
+
+RELEVANCE_HIGH = _relevance_from_cos(RELEVANCE_HIGH_COS)  # ≈ 0.65
+RELEVANCE_LOW = _relevance_from_cos(RELEVANCE_LOW_COS)  # ≈ -0.02 (scores L2 négatifs possibles)
+
+# Nœuds dont les tokens LLM sont streamés vers l'utilisateur (pas classify / sortie structurée)
+STREAMED_NODES = {"generate", "conversational"}
+
+# Budget du contexte envoyé à generate (caractères) : borne les tokens d'entrée
+CONTEXT_MAX_DOC_CHARS = 2000  # ≈ un chunk de 512 tokens
+CONTEXT_MAX_CHARS = 8000
+
+# Historique envoyé à generate : 6 derniers messages (3 échanges) → tokens d'entrée
+# bornés quelle que soit la longueur du thread
+HISTORY_WINDOW = 6
+
+# Au-delà de ce budget (tokens de l'historique du thread), les messages hors fenêtre
+# sont résumés en un seul message puis retirés de l'état → prompt et état bornés
+SUMMARY_TRIGGER_TOKENS = 3000
+SUMMARY_MAX_TOKENS = 200
+CHARS_PER_TOKEN = 4  # estimation quand le tokenizer tiktoken n'est pas disponible
+
+# Réponses fixes pré-traduites : {template_id: {lang: text}}
+REPLIES_PATH = Path(__file__).with_name("replies.yaml")
+with open(REPLIES_PATH) as f:
+    PRETRANSLATED: dict[str, dict[str, str]] = yaml.load(f, Loader=SafeLoader)
+
+
+# Détection de langue (fastText lid.176, extension C) / deep_translator ne servent
+# qu'aux nœuds off_topic / not_found : import paresseux pour ne pas alourdir le
+# démarrage de l'agent. fasttext-predict (prédiction seule) plutôt que fasttext 0.9.3,
+# dont predict appelle np.array(copy=False) → ValueError sous numpy 2
+LANGID_MODEL_URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.ftz"
+LANGID_MODEL_PATH = Path(os.getenv("LANGID_MODEL_PATH", "./data/lid.176.ftz"))
+
+
+@lru_cache(maxsize=1)
+def _language_detector():
+    import fasttext
+
+    # Modèle compressé (< 1 Mo) téléchargé une seule fois dans data/ ; écriture
+    # atomique → jamais de fichier tronqué réutilisé au démarrage suivant
+    if not LANGID_MODEL_PATH.exists():
+        from urllib.request import urlretrieve
+
+        LANGID_MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = LANGID_MODEL_PATH.with_suffix(".tmp")
+        urlretrieve(LANGID_MODEL_URL, tmp)
+        tmp.replace(LANGID_MODEL_PATH)
+    model = fasttext.load_model(str(LANGID_MODEL_PATH))
+
+    def detect(text: str) -> str:
+        labels, _ = model.predict(text.replace("\n", " "), k=1)
+        return labels[0].removeprefix("__label__")
+
+    return detect
 
-NOT_FOUND_REPLY = (
-    "I couldn't find relevant information about this in the Agile Lab handbook. "
-    "You might want to ask your manager or check internally."
-)
+
+@lru_cache(maxsize=32)
+def _translator(lang: str):
+    from deep_translator import GoogleTranslator
+
+    return GoogleTranslator(source="en", target=lang)
+
+
+@lru_cache(maxsize=512)
+def _detect_language(text: str) -> str:
+    """Langue d'un message utilisateur (mémoïsée : relances / messages répétés)."""
+    try:
+        return _language_detector()(text)
+    except Exception as e:
+        print(f"Détection de langue indisponible, réponse en anglais : {e}")
+        return "en"
+
+
+@lru_cache(maxsize=128)
+def _translate(template_id: str, lang: str) -> str:
+    """Fallback pour une langue non pré-traduite (appel réseau, mis en cache)."""
+    template = PRETRANSLATED[template_id]["en"]
+    try:
+        return _translator(lang).translate(template)
+    except Exception:
+        return template
+
+
+def load_retrieval_cache(path: str | Path) -> dict[str, dict]:
+    """
+    Charge un cache de retrieval précalculé {question: {"doc_ids", "scores"}}.
+    Ignoré (dict vide) s'il a été produit pour une autre collection / un autre modèle.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text())
+    if data.get("collection") != COLLECTION_NAME or data.get("embedding_model") != EMBEDDING_MODEL:
+        return {}
+    return data.get("entries", {})
 
 # ══════════════════════════════════════════════════════════════════════════════
 # STATE
@@ -42,152 +158,686 @@ NOT_FOUND_REPLY = (
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
+    last_question: str
     documents: List[Document]
+    scores: List[float]
     intent: str
     relevant: bool
     answer: str
+    summary: str
 
 # ══════════════════════════════════════════════════════════════════════════════
 # CLASSIFIER
 # ══════════════════════════════════════════════════════════════════════════════
 
+INTENTS = ("conversational", "handbook", "off_topic")
+
+# Classifieur rapide : petit modèle, réponse en un mot contrainte par logit_bias
+# (quelques tokens générés) ; sortie structurée du modèle principal en secours
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL_NAME", "gpt-4o-mini")
+CLASSIFIER_MAX_TOKENS = 5
+CLASSIFIER_LOGIT_BIAS = 5
+
+
 class IntentResult(BaseModel):
     intent: Literal["conversational", "handbook", "off_topic"] = Field(
         description="The intent of the user message."
     )
 
+
+@lru_cache(maxsize=8)
+def _encoding(model_name: str) -> tiktoken.Encoding | None:
+    """
+    Tokenizer du modèle. tiktoken télécharge le fichier BPE au premier usage →
+    None hors ligne / derrière un proxy (l'agent se construit quand même).
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def _token_count(messages: List[BaseMessage], model_name: str) -> int:
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return sum(len(str(m.content)) for m in messages) // CHARS_PER_TOKEN
+    return sum(len(encoding.encode(str(m.content))) for m in messages)
+
+
+def _intent_logit_bias(model_name: str) -> dict[int, int] | None:
+    """Biais positif sur les tokens des trois labels ; None sans tokenizer (pas de biais)."""
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return None
+    return {
+        token: CLASSIFIER_LOGIT_BIAS
+        for label in INTENTS
+        for token in encoding.encode(label)
+    }
+
+# Messages réduits à une salutation / un remerciement → conversational sans appel LLM.
+# Ancré en fin de chaîne : "hi, what is the vacation policy?" passe par le classifier.
+_GREETING_RE = re.compile(
+    r"^(hi|hello|hey|thanks|thank you|bye|ciao|salut|merci)[\s!.,]*$", re.I
+)
+INTENT_CACHE_MAX_LEN = 40  # seuls les messages courts (et répétitifs) sont mis en cache
+INTENT_CACHE_SIZE = 2048
+
 CLASSIFY_PROMPT = """Classify the intent of the user message into one of:
 - "conversational": greetings, small talk, thanks, or questions referring to previous statements (e.g. "tell me more", "why?", "va en détails").
 - "handbook": any specific question about Agile Lab policies, values, benefits.
-- "off_topic": technical or general questions unrelated to Agile Lab (e.g. "Naruto", "Python code").
+- "off_topic": technical or general questions unrelated to Agile Lab (e.g. "Naruto", "Python code")."""
+
+CLASSIFY_ONE_WORD = "\n\nAnswer with exactly one word: conversational, handbook or off_topic."
+
+# ══════════════════════════════════════════════════════════════════════════════
+# GENERATION
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Préfixe STABLE (identique à chaque appel) placé en tête pour profiter du prompt
+# caching automatique d'OpenAI ; le contexte dynamique vient dans un message séparé.
+GENERATE_PROMPT = """You are a helpful assistant for Agile Lab employees.
+Answer questions about the Agile Lab company handbook based on the context provided
+in the next system message AND the conversation history.
+
+Guidelines:
+- Only use information present in the context or in the conversation history.
+- If the user asks for more details about a previous answer, use the history.
+- If the context only partially answers the question, say what is covered and what is not.
+- Do not invent policies, numbers, dates, names or links.
+- Quote the source page title when it helps the user find the information.
+- Keep answers concise and well structured; use bullet points for lists of rules or steps.
+- Respond in the user's language."""
+
+CONVERSATIONAL_PROMPT = "Friendly assistant for Agile Lab employees. Respond in the user's language."
 
-{format_instructions}"""
+# Messages système constants construits une seule fois (messages immuables, pas de
+# validation pydantic à chaque tour). Cache de prompt OpenAI : seuls les préfixes
+# ≥ 1024 tokens sont mis en cache, et GENERATE_PROMPT n'en fait que ~170 → le préfixe
+# caché inclut le message de contexte, donc un hit suppose une récupération identique
+# (même question, relance). Pas de remplissage : il serait facturé à chaque appel
+_GENERATE_SYS = SystemMessage(content=GENERATE_PROMPT)
+_CONVERSATIONAL_SYS = SystemMessage(content=CONVERSATIONAL_PROMPT)
+
+SUMMARIZE_PROMPT = f"""Summarize the conversation so far in at most {SUMMARY_MAX_TOKENS} tokens.
+Merge it with the previous summary if one is given. Keep the topics discussed, the facts
+and numbers given in the answers, and anything the user may refer back to."""
+
+_SUMMARIZE_SYS = SystemMessage(content=SUMMARIZE_PROMPT)
+
+
+class GenerationResult(BaseModel):
+    """Verdict de pertinence + réponse en un seul appel (remplace le grader)."""
+
+    relevant: bool = Field(
+        description="True if at least one context document contains information useful to answer "
+        "the question (partial information counts, when in doubt → True). False if all documents are off-topic."
+    )
+    answer: str = Field(
+        description="The answer to the user's question, in the user's language. Empty if relevant is False."
+    )
+
+
+# Empreinte de ce qui façonne une réponse (prompts, schémas, réponses fixes, paramètres
+# de retrieval / contexte) : incluse dans la clé de l'AgentCache → une modification
+# invalide les réponses en cache au lieu de les resservir
+CACHE_FINGERPRINT = hashlib.sha256(
+    json.dumps(
+        [
+            CLASSIFY_PROMPT + CLASSIFY_ONE_WORD,
+            GENERATE_PROMPT,
+            CONVERSATIONAL_PROMPT,
+            SUMMARIZE_PROMPT,
+            IntentResult.model_json_schema(),
+            GenerationResult.model_json_schema(),
+            PRETRANSLATED,
+            [CLASSIFIER_MODEL, EMBEDDING_MODEL, RETRIEVE_K, RELEVANCE_HIGH_COS, RELEVANCE_LOW_COS],
+            [CONTEXT_MAX_DOC_CHARS, CONTEXT_MAX_CHARS, HISTORY_WINDOW],
+        ],
+        sort_keys=True,
+    ).encode()
+).hexdigest()[:16]
 
 # ══════════════════════════════════════════════════════════════════════════════
 # AGENT
 # ══════════════════════════════════════════════════════════════════════════════
 
 class HandbookAgent:
-    def __init__(self, model, checkpointer=None, thread_id: str = "1"):
+    def __init__(
+        self,
+        model,
+        checkpointer=None,
+        thread_id: str = "1",
+        cache: AgentCache | None = None,
+        http_client=None,
+        http_async_client=None,
+        retrieval_cache: dict[str, dict] | None = None,
+        semantic_cache: SemanticCache | None = None,
+        embeddings_cache: str | Path | None = None,
+    ):
         self.thread_id = thread_id
-        self.checkpointer = checkpointer or MemorySaver()
+        self.checkpointer = checkpointer or BoundedMemorySaver()
         self.model = model
-
-        _parser = PydanticOutputParser(pydantic_object=IntentResult)
-        self.classifier = self.model | _parser
-        self._classify_sys = CLASSIFY_PROMPT.format(
-            format_instructions=_parser.get_format_instructions()
+        self.cache = cache
+        self._intent_cache: dict[str, str] = {}
+        self.semantic_cache = semantic_cache
+        self._retrieval_cache = retrieval_cache or {}
+
+        self.fast_classifier = (
+            ChatPromptTemplate.from_messages(
+                [("system", CLASSIFY_PROMPT + CLASSIFY_ONE_WORD), MessagesPlaceholder("history")]
+            )
+            | ChatOpenAI(
+                model=CLASSIFIER_MODEL,
+                temperature=0,
+                max_tokens=CLASSIFIER_MAX_TOKENS,
+                logit_bias=_intent_logit_bias(CLASSIFIER_MODEL),
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            | StrOutputParser()
         )
-
-        vectorstore = Chroma(
+        # Secours : sortie structurée (function calling) du modèle principal
+        self.classifier = ChatPromptTemplate.from_messages(
+            [("system", CLASSIFY_PROMPT), MessagesPlaceholder("history")]
+        ) | self.model.with_structured_output(IntentResult, method="function_calling")
+
+        # même instance pour le cache sémantique et le retrieval → la question n'est embeddée
+        # qu'une fois. Cache disque des embeddings (non borné) sur demande seulement : utile
+        # aux suites d'éval, dont les questions sont fixes, pas aux questions libres de l'API
+        embeddings_kwargs = dict(
+            model=EMBEDDING_MODEL,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+        self.embeddings = (
+            CachedEmbeddings(cache_path=str(embeddings_cache), **embeddings_kwargs)
+            if embeddings_cache
+            else OpenAIEmbeddings(**embeddings_kwargs)
+        )
+        self.vectorstore = Chroma(
             collection_name=COLLECTION_NAME,
-            embedding_function=OpenAIEmbeddings(model="text-embedding-3-small"),
+            embedding_function=self.embeddings,
             persist_directory=CHROMA_DIR,
+            # pas d'appel HTTP de télémétrie à chaque ouverture de la collection ;
+            # sans CHROMA_PERSIST_DIR → collection en mémoire (persist_directory=None
+            # est refusé par la validation de Settings)
+            client_settings=Settings(
+                anonymized_telemetry=False,
+                **(
+                    {"is_persistent": True, "persist_directory": CHROMA_DIR}
+                    if CHROMA_DIR
+                    else {}
+                ),
+            ),
         )
-        self.retriever = vectorstore.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": 5, "fetch_k": 20},
+        # Nouvel id à chaque ré-ingestion (reset_collection) → corpus dans la clé de l'AgentCache
+        self._corpus_id = str(self.vectorstore._collection.id)
+        self.judged_generator = self.model.with_structured_output(
+            GenerationResult, method="function_calling"
         )
-        from grader.grade import GRADER_PROMPT, Grader
-        self.grader = Grader(model=self.model, prompt=GRADER_PROMPT)
-        self.graph = self._build_graph()
-
-    def _classify(self, state: AgentState) -> dict:
+        self.summarizer = self.model.bind(max_tokens=SUMMARY_MAX_TOKENS)
+        # Topologie compilée une seule fois (module) ; cet agent y est rebindé avec son
+        # checkpointer, et les nœuds le retrouvent via config["configurable"]["agent"]
+        # (posé par _config : la config d'un run remplace `configurable`, sans fusion)
+        self.graph = _compiled_graph().copy({"checkpointer": self.checkpointer})
+
+    def warmup(self):
+        """
+        Requête factice : charge l'index Chroma (et l'embedding, mis en cache) et le
+        modèle de détection de langue avant la 1re question.
+        """
+        self.vectorstore.similarity_search_with_relevance_scores("warmup", k=1)
+        _language_detector()
+
+    # Chaque nœud I/O existe en version sync (graph.invoke / stream) et async
+    # (graph.ainvoke / astream, appels natifs .ainvoke) ; la préparation des
+    # prompts est partagée.
+
+    def _last_question(self, state: AgentState) -> str:
+        # Posée à l'entrée du graphe (_input) → pas de parcours de l'historique
+        return state.get("last_question", "")
+
+    def _classify_input(self, state: AgentState) -> dict:
         # Utilise les 5 derniers messages pour le contexte sémantique
-        result = self.classifier.invoke(
-            [SystemMessage(content=self._classify_sys)] + state["messages"][-5:]
-        )
-        return {"intent": result.intent}
-
-    def _retrieve(self, state: AgentState) -> dict:
-        last_human = next(m for m in reversed(state["messages"]) if isinstance(m, HumanMessage))
-        return {"documents": self.retriever.invoke(last_human.content)}
-
-    def _grade(self, state: AgentState) -> dict:
-        last_human = next(m for m in reversed(state["messages"]) if isinstance(m, HumanMessage))
-        
+        return {"history": state["messages"][-5:]}
+
+    def _known_intent(self, text: str) -> str | None:
+        """Intent sans LLM : salutation évidente ou message court déjà classifié."""
+        if _GREETING_RE.match(text):
+            return "conversational"
+        return self._intent_cache.get(text.lower())
+
+    def _remember_intent(self, text: str, intent: str):
+        key = text.lower()
+        if len(key) > INTENT_CACHE_MAX_LEN:
+            return
+        if len(self._intent_cache) >= INTENT_CACHE_SIZE:
+            # éviction FIFO (les dicts gardent l'ordre d'insertion)
+            del self._intent_cache[next(iter(self._intent_cache))]
+        self._intent_cache[key] = intent
+
+    @staticmethod
+    def _parse_intent(output: str) -> str | None:
+        intent = output.strip().strip("\"'.").lower()
+        return intent if intent in INTENTS else None
+
+    def _classify(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        text = self._last_question(state).strip()
+        if intent := self._known_intent(text):
+            return {"intent": intent}
+        inputs = self._classify_input(state)
+        intent = self._parse_intent(self.fast_classifier.invoke(inputs))
+        if intent is None:
+            intent = self.classifier.invoke(inputs).intent
+        self._remember_intent(text, intent)
+        return {"intent": intent}
+
+    async def _aclassify(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        text = self._last_question(state).strip()
+        if intent := self._known_intent(text):
+            return {"intent": intent}
+        inputs = self._classify_input(state)
+        intent = self._parse_intent(await self.fast_classifier.ainvoke(inputs))
+        if intent is None:
+            intent = (await self.classifier.ainvoke(inputs)).intent
+        self._remember_intent(text, intent)
+        return {"intent": intent}
+
+    def _retrieved(self, results: list[tuple[Document, float]]) -> dict:
+        return {
+            "documents": [doc for doc, _ in results],
+            "scores": [score for _, score in results],
+        }
+
+    def _cached_retrieval(self, question: str) -> list[tuple[Document, float]] | None:
+        """Hit du cache précalculé → docs réhydratés par id, sans embedding ni recherche."""
+        entry = self._retrieval_cache.get(question)
+        if entry is None:
+            return None
+        found = self.vectorstore.get(ids=entry["doc_ids"])
+        by_id = {
+            id_: Document(id=id_, page_content=text, metadata=meta or {})
+            for id_, text, meta in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        if len(by_id) != len(entry["doc_ids"]):
+            return None  # collection ré-ingérée depuis → retrieval normal
+        return [(by_id[i], score) for i, score in zip(entry["doc_ids"], entry["scores"])]
+
+    def _query_embedding(self, config: RunnableConfig | None) -> list[float] | None:
+        # Embedding de la question déjà calculé pour le cache sémantique (hors état checkpointé)
+        return ((config or {}).get("configurable") or {}).get("query_embedding")
+
+    def _search_by_vector(self, embedding: list[float]) -> list[tuple[Document, float]]:
+        # Mêmes scores que similarity_search_with_relevance_scores (distance → relevance)
+        relevance = self.vectorstore._select_relevance_score_fn()
+        return [
+            (doc, relevance(distance))
+            for doc, distance in self.vectorstore.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=RETRIEVE_K
+            )
+        ]
+
+    def _retrieve(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        question = self._last_question(state)
+        results = self._cached_retrieval(question)
+        if results is None and (embedding := self._query_embedding(config)) is not None:
+            results = self._search_by_vector(embedding)
+        if results is None:
+            # Recherche par similarité avec scores → permet à generate de court-circuiter le jugement
+            results = self.vectorstore.similarity_search_with_relevance_scores(
+                question, k=RETRIEVE_K
+            )
+        return self._retrieved(results)
+
+    async def _aretrieve(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        question = self._last_question(state)
+        results = self._cached_retrieval(question)
+        if results is None and (embedding := self._query_embedding(config)) is not None:
+            results = await asyncio.to_thread(self._search_by_vector, embedding)
+        if results is None:
+            results = await self.vectorstore.asimilarity_search_with_relevance_scores(
+                question, k=RETRIEVE_K
+            )
+        return self._retrieved(results)
+
+    def _relevance_shortcut(self, state: AgentState) -> bool | None:
+        """Verdict de pertinence sans LLM quand c'est possible, sinon None."""
         # Tolérance pour les questions de suivi courtes (ex: "va en détails")
-        if len(last_human.content.split()) < 4 and len(state["messages"]) > 2:
-            return {"relevant": True}
-
-        grader_result = self.grader(question=last_human.content, documents=state["documents"])
-        return {"relevant": grader_result["document_relevance"]}
-
-    def _generate(self, state: AgentState) -> dict:
-        context = "\n\n".join(
-            f"[Source: {doc.metadata.get('title', 'n/a')}]\n{doc.page_content}"
-            for doc in state["documents"]
-        )
-        prompt_messages = [
-            SystemMessage(content=f"""You are a helpful assistant for Agile Lab.
-            Answer based on the context below AND the conversation history.
-            If the user asks for more details about a previous answer, use the history.
-            Context: {context}""")
-        ] + state["messages"]
-
-        response = self.model.invoke(prompt_messages)
+        if len(self._last_question(state).split()) < 4 and len(state["messages"]) > 2:
+            return True
+
+        # Scores de retrieval nets → pas besoin de juger la pertinence
+        scores = state.get("scores") or []
+        if scores and max(scores) >= RELEVANCE_HIGH:
+            return True
+        if scores and max(scores) < RELEVANCE_LOW:
+            return False
+        return None
+
+    def _context(self, documents: List[Document]) -> str:
+        # Docs pris dans l'ordre du retrieval (meilleur score d'abord) jusqu'au budget,
+        # sans doublon de chunk ; puis ordre déterministe (chunk_id, puis id du doc pour
+        # les docs sans chunk_id, placés après) → même contexte pour la même récupération
+        selected, seen, total = [], set(), 0
+        for doc in documents:
+            chunk_id = doc.metadata.get("chunk_id")
+            if chunk_id is not None and chunk_id in seen:
+                continue
+            piece = f"[Source: {doc.metadata.get('title', 'n/a')}]\n{doc.page_content[:CONTEXT_MAX_DOC_CHARS]}"
+            if selected and total + len(piece) > CONTEXT_MAX_CHARS:
+                break
+            seen.add(chunk_id)
+            order = (False, chunk_id) if chunk_id is not None else (True, doc.id or "")
+            selected.append((order, piece))
+            total += len(piece)
+        selected.sort(key=lambda item: item[0])
+        return "\n\n".join(piece for _, piece in selected)
+
+    @staticmethod
+    def _summary_messages(state: AgentState) -> list:
+        # Résumé des échanges compactés (voir acompact), placé avant la fenêtre d'historique
+        summary = state.get("summary")
+        return [SystemMessage(content=f"Conversation summary:\n{summary}")] if summary else []
+
+    def _generate_messages(self, state: AgentState) -> list:
+        context = self._context(state["documents"])
+        return [
+            _GENERATE_SYS,
+            SystemMessage(content=f"Context:\n{context}"),
+            *self._summary_messages(state),
+        ] + state["messages"][-HISTORY_WINDOW:]
+
+    # generate = grade + generate fusionnés : un seul appel LLM juge la pertinence
+    # du contexte ET répond ; relevant=False → not_found.
+
+    def _judged(self, result: GenerationResult) -> dict:
+        if not result.relevant:
+            return {"relevant": False}
+        return {"relevant": True, "messages": [AIMessage(content=result.answer)], "answer": result.answer}
+
+    def _generate(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        relevant = self._relevance_shortcut(state)
+        if relevant is False:
+            return {"relevant": False}
+        if relevant:
+            response = self.model.invoke(self._generate_messages(state))
+            return {"relevant": True, "messages": [response], "answer": response.content}
+        return self._judged(self.judged_generator.invoke(self._generate_messages(state)))
+
+    async def _agenerate(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        relevant = self._relevance_shortcut(state)
+        if relevant is False:
+            return {"relevant": False}
+        if relevant:
+            response = await self.model.ainvoke(self._generate_messages(state))
+            return {"relevant": True, "messages": [response], "answer": response.content}
+        return self._judged(await self.judged_generator.ainvoke(self._generate_messages(state)))
+
+    def _conversational_messages(self, state: AgentState) -> list:
+        return [_CONVERSATIONAL_SYS, *self._summary_messages(state)] + state["messages"][-3:]
+
+    def _conversational(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        response = self.model.invoke(self._conversational_messages(state))
         return {"messages": [response], "answer": response.content}
 
-    def _conversational(self, state: AgentState) -> dict:
-        response = self.model.invoke([
-            SystemMessage(content="Friendly assistant for Agile Lab employees. Respond in the user's language.")
-        ] + state["messages"][-3:])
+    async def _aconversational(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        response = await self.model.ainvoke(self._conversational_messages(state))
         return {"messages": [response], "answer": response.content}
 
-    def _reply(self, state: AgentState, template: str) -> dict:
-        last_human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
-        user_text = last_human.content if last_human else ""
-        
-        # Langdetect avec fallback
-        try:
-            lang = ld_detect(user_text)
-        except:
-            lang = "en"
-
-        try:
-            text = GoogleTranslator(source="en", target=lang).translate(template) if lang != "en" else template
-        except:
-            text = template
+    def _reply(self, state: AgentState, template_id: str) -> dict:
+        lang = _detect_language(self._last_question(state))
+        translations = PRETRANSLATED[template_id]
+        text = translations[lang] if lang in translations else _translate(template_id, lang)
 
         return {"messages": [AIMessage(content=text)], "answer": text}
 
-    def _off_topic(self, state: AgentState) -> dict:
-        res = self._reply(state, OFF_TOPIC_REPLY)
+    def _off_topic(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        res = self._reply(state, "off_topic")
         return {**res, "intent": "off_topic"}
 
-    def _not_found(self, state: AgentState) -> dict:
-        res = self._reply(state, NOT_FOUND_REPLY)
+    def _not_found(self, state: AgentState, config: RunnableConfig = None) -> dict:
+        res = self._reply(state, "not_found")
         return {**res, "intent": "handbook"}
 
-    def _route_intent(self, state: AgentState) -> str:
-        intent = state.get("intent", "handbook")
-        return intent if intent in ["conversational", "off_topic"] else "retrieve"
-
-    def _route_grade(self, state: AgentState) -> str:
-        return "generate" if state.get("relevant") else "not_found"
-
-    def _build_graph(self):
-        graph = StateGraph(AgentState)
-        graph.add_node("classify", self._classify)
-        graph.add_node("retrieve", self._retrieve)
-        graph.add_node("grade", self._grade)
-        graph.add_node("generate", self._generate)
-        graph.add_node("conversational", self._conversational)
-        graph.add_node("off_topic", self._off_topic)
-        graph.add_node("not_found", self._not_found)
-
-        graph.add_edge(START, "classify")
-        graph.add_edge("retrieve", "grade")
-        graph.add_conditional_edges("classify", self._route_intent, 
-            {"conversational": "conversational", "retrieve": "retrieve", "off_topic": "off_topic"})
-        graph.add_conditional_edges("grade", self._route_grade, 
-            {"generate": "generate", "not_found": "not_found"})
-        
-        for node in ["generate", "conversational", "off_topic", "not_found"]:
-            graph.add_edge(node, END)
-        return graph.compile(checkpointer=self.checkpointer)
+    @staticmethod
+    def _input(question: str) -> dict:
+        return {"messages": [HumanMessage(content=question)], "last_question": question}
+
+    def _config(self, thread_id: str = None) -> dict:
+        """Config de tout appel au graphe (run, get_state, update_state) de cet agent."""
+        return {"configurable": {"thread_id": thread_id or self.thread_id, "agent": self}}
+
+    @staticmethod
+    def _run_config(config: dict, embedding: list[float] | None) -> dict:
+        # Embedding du cache sémantique réutilisé par retrieve → un seul embedding par question
+        if embedding is None:
+            return config
+        return {"configurable": {**config["configurable"], "query_embedding": embedding}}
+
+    def _cache_key(self, question: str, config: dict) -> str | None:
+        if self.cache is None:
+            return None
+        # L'historique du thread fait partie de la clé : un suivi ("tell me more") ne doit pas
+        # réutiliser la réponse d'une autre conversation
+        values = self.graph.get_state(config).values
+        history = self._summary_messages(values) + values.get("messages", [])
+        llm_string = getattr(self.model, "model_name", type(self.model).__name__)
+        version = f"{llm_string}|{CACHE_FINGERPRINT}|{self._corpus_id}"
+        return AgentCache.make_key(version, question, history)
+
+    def is_cached(self, question: str, thread_id: str = None) -> bool:
+        """Vrai si la réponse viendra de l'AgentCache (latence d'une lecture SQLite, pas d'un run)."""
+        key = self._cache_key(question, self._config(thread_id))
+        return key is not None and self.cache.lookup(key) is not None
+
+    def _record_cached_turn(self, config: dict, question: str, answer: str, intent: str):
+        # Hit → on ajoute quand même le tour à l'historique pour les questions de suivi
+        self.graph.update_state(
+            config,
+            {
+                "messages": [HumanMessage(content=question), AIMessage(content=answer)],
+                "last_question": question,
+                "answer": answer,
+                "intent": intent,
+                "relevant": True,
+            },
+            as_node="generate",
+        )
+
+    # ── Compaction de l'historique ────────────────────────────────────────────
+    # Appelée entre deux tours (hors du chemin de la réponse) : quand l'historique du
+    # thread dépasse SUMMARY_TRIGGER_TOKENS, les messages hors fenêtre sont fusionnés
+    # dans `summary` puis retirés de l'état.
+
+    def _compaction(self, state: dict) -> tuple[list, list] | None:
+        """(prompt du résumeur, messages à retirer), ou None si rien à compacter."""
+        messages = state.get("messages", [])
+        if len(messages) <= HISTORY_WINDOW:
+            return None
+        model_name = getattr(self.model, "model_name", CLASSIFIER_MODEL)
+        if _token_count(messages, model_name) <= SUMMARY_TRIGGER_TOKENS:
+            return None
+        old = messages[:-HISTORY_WINDOW]
+        return [_SUMMARIZE_SYS, *self._summary_messages(state), *old], old
+
+    @staticmethod
+    def _compacted(summary: str, old: list) -> dict:
+        return {
+            "summary": summary,
+            "messages": [RemoveMessage(id=m.id) for m in old],
+            "relevant": True,
+        }
+
+    def compact(self, thread_id: str = None) -> bool:
+        config = self._config(thread_id)
+        compaction = self._compaction(self.graph.get_state(config).values)
+        if compaction is None:
+            return False
+        prompt, old = compaction
+        summary = self.summarizer.invoke(prompt).content
+        self.graph.update_state(config, self._compacted(summary, old), as_node="generate")
+        return True
+
+    async def acompact(self, thread_id: str = None) -> bool:
+        config = self._config(thread_id)
+        compaction = self._compaction((await self.graph.aget_state(config)).values)
+        if compaction is None:
+            return False
+        prompt, old = compaction
+        summary = (await self.summarizer.ainvoke(prompt)).content
+        await self.graph.aupdate_state(config, self._compacted(summary, old), as_node="generate")
+        return True
+
+    def _semantic_lookup(self, config: dict, question: str, embedding) -> tuple[str, str] | None:
+        hit = self.semantic_cache.lookup(embedding)
+        if hit is None:
+            return None
+        self._record_cached_turn(config, question, hit.answer, hit.source)
+        return hit.answer, hit.source
+
+    def _store(self, key: str | None, embedding, answer: str, intent: str, question: str = ""):
+        if key:
+            self.cache.update(key, (answer, intent))
+        # Réponses conversationnelles dépendantes de l'historique → jamais en cache sémantique
+        if embedding is not None and intent != "conversational":
+            self.semantic_cache.insert(embedding, answer, intent, question)
 
     def __call__(self, question: str, thread_id: str = None) -> tuple[str, str]:
-        config = {"configurable": {"thread_id": thread_id or self.thread_id}}
-        result = self.graph.invoke({"messages": [HumanMessage(content=question)]}, config=config)
-        return result["answer"], result.get("intent", "handbook")
\ No newline at end of file
+        config = self._config(thread_id)
+        key = self._cache_key(question, config)
+        if key and (hit := self.cache.lookup(key)):
+            self._record_cached_turn(config, question, *hit)
+            return hit
+
+        embedding = None
+        if self.semantic_cache is not None:
+            embedding = self.embeddings.embed_query(question)
+            if hit := self._semantic_lookup(config, question, embedding):
+                return hit
+
+        result = self.graph.invoke(self._input(question), config=self._run_config(config, embedding))
+        answer, intent = result["answer"], result.get("intent", "handbook")
+        self._store(key, embedding, answer, intent, question)
+        return answer, intent
+
+    async def _acached(self, question: str, config: dict) -> tuple[tuple[str, str] | None, str | None, list | None]:
+        """(hit éventuel, clé exacte, embedding de la question) avant un run du graphe."""
+        key = self._cache_key(question, config)
+        if key and (hit := self.cache.lookup(key)):
+            self._record_cached_turn(config, question, *hit)
+            return hit, key, None
+
+        embedding = None
+        if self.semantic_cache is not None:
+            embedding = await self.embeddings.aembed_query(question)
+            if hit := self._semantic_lookup(config, question, embedding):
+                return hit, key, embedding
+        return None, key, embedding
+
+    async def ainvoke(self, question: str, thread_id: str = None) -> tuple[str, str]:
+        config = self._config(thread_id)
+        hit, key, embedding = await self._acached(question, config)
+        if hit:
+            return hit
+
+        result = await self.graph.ainvoke(self._input(question), config=self._run_config(config, embedding))
+        answer, intent = result["answer"], result.get("intent", "handbook")
+        self._store(key, embedding, answer, intent, question)
+        return answer, intent
+
+    async def astream(self, question: str, thread_id: str = None) -> AsyncIterator[dict]:
+        """
+        Comme ainvoke, mais produit les tokens de la réponse au fil de l'eau :
+        {"token": str}* puis {"answer": str, "source": str}.
+        Réponses en cache / fixes / jugées (sortie structurée) → un seul token.
+        """
+        config = self._config(thread_id)
+        hit, key, embedding = await self._acached(question, config)
+        if hit:
+            yield {"token": hit[0]}
+            yield {"answer": hit[0], "source": hit[1]}
+            return
+
+        streamed = False
+        async for chunk, meta in self.graph.astream(
+            self._input(question),
+            config=self._run_config(config, embedding),
+            stream_mode="messages",
+        ):
+            if (
+                meta.get("langgraph_node") in STREAMED_NODES
+                and isinstance(chunk, AIMessageChunk)
+                and chunk.content
+            ):
+                streamed = True
+                yield {"token": chunk.content}
+
+        result = (await self.graph.aget_state(config)).values
+        answer, intent = result["answer"], result.get("intent", "handbook")
+        if not streamed:
+            yield {"token": answer}
+        self._store(key, embedding, answer, intent, question)
+        yield {"answer": answer, "source": intent}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# GRAPH
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _node(name: str, async_name: str | None = None) -> RunnableLambda:
+    """Nœud générique : appelle la méthode `name` de l'agent porté par la config."""
+
+    def func(state: AgentState, config: RunnableConfig) -> dict:
+        return getattr(config["configurable"]["agent"], name)(state, config)
+
+    if async_name is None:
+        return RunnableLambda(func, name=name)
+
+    async def afunc(state: AgentState, config: RunnableConfig) -> dict:
+        return await getattr(config["configurable"]["agent"], async_name)(state, config)
+
+    return RunnableLambda(func, afunc=afunc, name=name)
+
+
+def _route(state: AgentState) -> dict:
+    # Point de jonction : classify et retrieve (en parallèle) sont tous deux terminés
+    return {}
+
+
+def _route_intent(state: AgentState) -> str:
+    intent = state.get("intent", "handbook")
+    return intent if intent in ["conversational", "off_topic"] else "generate"
+
+
+def _route_relevance(state: AgentState) -> str:
+    return "end" if state.get("relevant") else "not_found"
+
+
+@lru_cache(maxsize=1)
+def _compiled_graph():
+    graph = StateGraph(AgentState)
+    graph.add_node("classify", _node("_classify", "_aclassify"))
+    graph.add_node("retrieve", _node("_retrieve", "_aretrieve"))
+    graph.add_node("generate", _node("_generate", "_agenerate"))
+    graph.add_node("conversational", _node("_conversational", "_aconversational"))
+    graph.add_node("off_topic", _node("_off_topic"))
+    graph.add_node("not_found", _node("_not_found"))
+    graph.add_node("route", _route)
+
+    # classify et retrieve partent en parallèle depuis START ; les docs récupérés
+    # spéculativement sont ignorés sur les routes conversational / off_topic
+    graph.add_edge(START, "classify")
+    graph.add_edge(START, "retrieve")
+    graph.add_edge(["classify", "retrieve"], "route")
+    graph.add_conditional_edges("route", _route_intent,
+        {"conversational": "conversational", "generate": "generate", "off_topic": "off_topic"})
+    graph.add_conditional_edges("generate", _route_relevance,
+        {"end": END, "not_found": "not_found"})
+
+    for node in ["conversational", "off_topic", "not_found"]:
+        graph.add_edge(node, END)
+    return graph.compile()
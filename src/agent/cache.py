@@ -0,0 +1,163 @@
+import hashlib
+import json
+import sqlite3
+import struct
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage
+from langchain_openai import OpenAIEmbeddings
+from pydantic import PrivateAttr
+
+DEFAULT_CACHE_PATH = Path("./data/agent_cache.sqlite")
+DEFAULT_EMBEDDINGS_CACHE_PATH = Path("./data/embeddings_cache.sqlite")
+
+
+class AgentCache:
+    """
+    Cache persistant (SQLite) des réponses de l'agent.
+
+    Clé = sha256(model + empreinte prompts / corpus | historique de la conversation | question)
+    Valeur = (answer, intent) sérialisé en JSON.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # partagé entre les threads du serveur / de l'éval
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(llm_string: str, question: str, history: List[BaseMessage]) -> str:
+        h = hashlib.sha256()
+        h.update(llm_string.encode())
+        for m in history:
+            h.update(b"|" + m.type.encode() + b":" + str(m.content).encode())
+        h.update(b"|" + question.encode())
+        return h.hexdigest()
+
+    def lookup(self, key: str) -> Optional[tuple[str, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def update(self, key: str, value: tuple[str, str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+
+def quantize(vector: List[float]) -> bytes:
+    """float → int8 avec échelle par vecteur : blob = scale (float32) + int8 × dim."""
+    scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+    q = array("b", (max(-127, min(127, round(x / scale))) for x in vector))
+    return struct.pack("<f", scale) + q.tobytes()
+
+
+def dequantize(blob: bytes) -> List[float]:
+    (scale,) = struct.unpack_from("<f", blob)
+    return [x * scale for x in array("b", blob[4:])]
+
+
+class CachedEmbeddings(OpenAIEmbeddings):
+    """
+    OpenAIEmbeddings avec cache persistant (SQLite) des vecteurs.
+
+    Clé = sha256(model:text) → un texte déjà vu (question de test, requête
+    répétée) n'appelle plus l'API. Vecteurs quantifiés en int8 (4× plus
+    petit qu'en float32, similarité cosinus quasi inchangée).
+    """
+
+    cache_path: str = str(DEFAULT_EMBEDDINGS_CACHE_PATH)
+
+    _conn: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.cache_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings_q8 (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+                )
+        return self._conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}:{text}".encode()).hexdigest()
+
+    def _lookup(self, texts: List[str]) -> tuple[list, list[int]]:
+        """Retourne (vecteurs ou None par texte, indices des textes manquants)."""
+        keys = [self._key(t) for t in texts]
+        with self._lock:
+            db = self._db()
+            found = {
+                key: blob
+                for key, blob in db.execute(
+                    f"SELECT key, vec FROM embeddings_q8 WHERE key IN ({','.join('?' * len(keys))})",
+                    keys,
+                )
+            }
+        vectors = [
+            dequantize(found[k]) if k in found else None for k in keys
+        ]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        return vectors, missing
+
+    def _store(self, texts: List[str], vectors: List[List[float]]):
+        with self._lock, self._db() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO embeddings_q8 (key, vec) VALUES (?, ?)",
+                [(self._key(t), quantize(v)) for t, v in zip(texts, vectors)],
+            )
+
+    def embed_documents(
+        self, texts: List[str], chunk_size: Optional[int] = None, **kwargs
+    ) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors, missing = self._lookup(texts)
+        if missing:
+            new_texts = [texts[i] for i in missing]
+            new_vectors = super().embed_documents(new_texts, chunk_size, **kwargs)
+            self._store(new_texts, new_vectors)
+            for i, v in zip(missing, new_vectors):
+                vectors[i] = v
+        return vectors
+
+    async def aembed_documents(
+        self, texts: List[str], chunk_size: Optional[int] = None, **kwargs
+    ) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors, missing = self._lookup(texts)
+        if missing:
+            new_texts = [texts[i] for i in missing]
+            new_vectors = await super().aembed_documents(new_texts, chunk_size, **kwargs)
+            self._store(new_texts, new_vectors)
+            for i, v in zip(missing, new_vectors):
+                vectors[i] = v
+        return vectors
+
+    # Requêtes de retrieval (Chroma appelle embed_query) → toujours via le cache,
+    # quelle que soit l'implémentation de embed_query dans OpenAIEmbeddings
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        return self.embed_documents([text], **kwargs)[0]
+
+    async def aembed_query(self, text: str, **kwargs) -> List[float]:
+        return (await self.aembed_documents([text], **kwargs))[0]
@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+
+DEFAULT_MAX_THREADS = 1000
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver borné : au-delà de max_threads conversations, le thread_id le
+    moins récemment écrit est supprimé (checkpoints, writes, blobs).
+
+    MemorySaver seul garde tous les threads pour toute la vie du process →
+    mémoire non bornée sur l'API publique (un thread_id par utilisateur).
+    """
+
+    def __init__(self, max_threads: int = DEFAULT_MAX_THREADS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self._threads: OrderedDict[str, None] = OrderedDict()
+        self._lru_lock = threading.Lock()
+
+    def _touch(self, thread_id: str):
+        with self._lru_lock:
+            self._threads[thread_id] = None
+            self._threads.move_to_end(thread_id)
+            evicted = [
+                self._threads.popitem(last=False)[0]
+                for _ in range(len(self._threads) - self.max_threads)
+            ]
+        for old in evicted:
+            self.delete_thread(old)
+
+    # aput délègue à put → un seul point d'entrée à surveiller
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        self._touch(config["configurable"]["thread_id"])
+        return super().put(config, checkpoint, metadata, new_versions)
@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_TTL = 7 * 24 * 3600  # secondes
+DEFAULT_MAX_SIZE = 10_000
+DEFAULT_SEMANTIC_CACHE_PATH = Path("./data/semantic_cache.sqlite")
+
+
+class SemanticHit(NamedTuple):
+    answer: str
+    source: str
+    similarity: float
+
+
+class SemanticCache:
+    """
+    Cache sémantique en mémoire des réponses de l'agent.
+
+    Clé = embedding (normalisé L2) de la question → une paraphrase d'une
+    question déjà traitée (cosinus ≥ threshold) renvoie la réponse stockée
+    sans traverser le graphe. Recherche exacte par produit scalaire NumPy,
+    suffisante pour quelques milliers d'entrées.
+
+    Avec `path`, les entrées sont aussi écrites dans SQLite (embedding float32
+    en BLOB) et rechargées au démarrage → le cache survit aux sessions.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl: float = DEFAULT_TTL,
+        max_size: int = DEFAULT_MAX_SIZE,
+        path: str | Path | None = None,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        # (answer, source, ts, rowid SQLite ou None)
+        self._entries: list[tuple[str, str, float, Optional[int]]] = []
+        self._lock = threading.Lock()
+
+        self._conn: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS semantic_cache ("
+                    "question TEXT, embedding BLOB NOT NULL, answer TEXT NOT NULL, "
+                    "source TEXT NOT NULL, ts REAL NOT NULL)"
+                )
+            self._load()
+
+    def _load(self):
+        """Recharge les entrées non expirées (les plus récentes, dans l'ordre d'insertion)."""
+        now = time.time()
+        with self._conn:
+            self._conn.execute("DELETE FROM semantic_cache WHERE ts < ?", (now - self.ttl,))
+        rows = self._conn.execute(
+            "SELECT embedding, answer, source, ts, rowid FROM ("
+            "SELECT rowid, * FROM semantic_cache ORDER BY ts DESC LIMIT ?"
+            ") ORDER BY ts",
+            (self.max_size,),
+        ).fetchall()
+        if rows:
+            self._vectors = np.vstack([np.frombuffer(blob, dtype=np.float32) for blob, *_ in rows])
+            self._entries = [(answer, source, ts, rowid) for _, answer, source, ts, rowid in rows]
+            # lignes au-delà de max_size (jamais rechargées) : supprimées du fichier
+            with self._conn:
+                self._conn.execute("DELETE FROM semantic_cache WHERE ts < ?", (rows[0][3],))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        v = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _delete_rows(self, entries: list[tuple[str, str, float, Optional[int]]]):
+        """Supprime de SQLite les entrées retirées de la mémoire (à appeler dans une transaction)."""
+        rowids = [(rowid,) for *_, rowid in entries if rowid is not None]
+        if self._conn is not None and rowids:
+            self._conn.executemany("DELETE FROM semantic_cache WHERE rowid = ?", rowids)
+
+    def _evict_expired(self, now: float):
+        keep = [i for i, (_, _, ts, _) in enumerate(self._entries) if now - ts < self.ttl]
+        if len(keep) < len(self._entries):
+            kept = set(keep)
+            expired = [e for i, e in enumerate(self._entries) if i not in kept]
+            if self._conn is not None:
+                with self._conn:
+                    self._delete_rows(expired)
+            self._vectors = self._vectors[keep]
+            self._entries = [self._entries[i] for i in keep]
+
+    def lookup(self, embedding: List[float]) -> Optional[SemanticHit]:
+        query = self._normalize(embedding)
+        with self._lock:
+            self._evict_expired(time.time())
+            if not self._entries:
+                self.misses += 1
+                return None
+            sims = self._vectors @ query
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            answer, source, *_ = self._entries[best]
+            return SemanticHit(answer, source, float(sims[best]))
+
+    def insert(self, embedding: List[float], answer: str, source: str, question: str = ""):
+        vector = self._normalize(embedding)[None, :]
+        ts = time.time()
+        with self._lock:
+            # FIFO : on retire les plus anciennes entrées au-delà de max_size
+            overflow = max(0, len(self._entries) + 1 - self.max_size)
+            rowid = None
+            if self._conn is not None:
+                # insertion et suppression des évincées dans la même transaction → le
+                # fichier ne recharge jamais une entrée sortie du cache
+                with self._conn:
+                    rowid = self._conn.execute(
+                        "INSERT INTO semantic_cache (question, embedding, answer, source, ts) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (question, vector.tobytes(), answer, source, ts),
+                    ).lastrowid
+                    self._delete_rows(self._entries[:overflow])
+            if not self._entries:
+                self._vectors = vector
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append((answer, source, ts, rowid))
+            if overflow:
+                self._vectors = self._vectors[overflow:]
+                self._entries = self._entries[overflow:]
+
+    def clear(self):
+        with self._lock:
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM semantic_cache")
+            self._vectors = np.empty((0, 0), dtype=np.float32)
+            self._entries = []
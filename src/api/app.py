@@ -5,6 +5,7 @@
 ║  Endpoints :                                                 ║
 ║    GET  /       ← interface HTML                            ║
 ║    POST /ask    ← question → réponse                        ║
+║    POST /ask/stream ← question → réponse en SSE (tokens)    ║
 ║    GET  /health ← vérifier que l'API tourne                 ║
 ║                                                              ║
 ║  Lancer avec :                                               ║
@@ -12,19 +13,24 @@
 ╚══════════════════════════════════════════════════════════════╝
 """
 
+import asyncio
+import json
 import os
 from contextlib import asynccontextmanager
 from pathlib import Path
+from weakref import WeakValueDictionary
 
+import httpx
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
 from src.agent.agent import HandbookAgent
+from src.agent.semantic_cache import SemanticCache
 
 load_dotenv()
 
@@ -40,16 +46,102 @@ STATIC_DIR = ROOT_DIR / "static"
 
 resources = {}
 
+# Clients HTTP partagés par le LLM et les embeddings : keep-alive + HTTP/2
+# (classify / retrieve / generate multiplexés sur la même connexion)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+HTTP_TIMEOUT = 30.0
+
+# Un verrou par thread_id : deux requêtes d'une même conversation ne modifient
+# pas l'état MemorySaver en même temps ; les conversations différentes restent concurrentes.
+# MemorySaver vit dans le process → garder un seul worker uvicorn (sinon l'historique
+# d'un thread_id dépend du worker qui reçoit la requête).
+# Références faibles : un verrou n'existe que tant qu'une requête le tient ou l'attend
+# (référence forte dans son `async with`) → pas d'entrée par thread_id jamais vu.
+thread_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+
+def _thread_lock(thread_id: str) -> asyncio.Lock:
+    lock = thread_locks.get(thread_id)
+    if lock is None:
+        lock = thread_locks[thread_id] = asyncio.Lock()
+    return lock
+
+
+# Requêtes identiques (même thread_id + même question) en vol : la 2e attend la
+# tâche de la 1re au lieu de relancer le pipeline (double-submit, onglets parallèles)
+INFLIGHT_TIMEOUT = 120.0  # secondes
+inflight: dict[tuple[str, str], asyncio.Task] = {}
+
+
+# Résumés d'historique lancés après une réponse (références fortes jusqu'à la fin)
+compactions: set[asyncio.Task] = set()
+
+
+async def _compact(thread_id: str):
+    # Même verrou que les requêtes : le résumé ne réécrit pas l'état pendant un tour
+    async with _thread_lock(thread_id):
+        try:
+            await resources["agent"].acompact(thread_id)
+        except Exception as e:
+            print(f"Resume de l'historique ignore ({thread_id}) : {e}")
+
+
+def _schedule_compaction(thread_id: str):
+    task = asyncio.create_task(_compact(thread_id))
+    compactions.add(task)
+    task.add_done_callback(compactions.discard)
+
+
+async def _answer(question: str, thread_id: str) -> tuple[str, str]:
+    # Chemin async de l'agent → la boucle d'événements reste libre pendant les appels OpenAI
+    async with _thread_lock(thread_id):
+        result = await resources["agent"].ainvoke(question, thread_id=thread_id)
+    _schedule_compaction(thread_id)
+    return result
+
+
+def _shared_answer(question: str, thread_id: str) -> asyncio.Task:
+    key = (thread_id, question)
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_answer(question, thread_id))
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return task
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Demarrage — initialisation de l'agent...")
     model_name = os.getenv("MODEL_NAME")
-    llm = ChatOpenAI(model=model_name, temperature=0)
-    resources["agent"] = HandbookAgent(model=llm)
+    http_client = httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    http_async_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    llm = ChatOpenAI(
+        model=model_name,
+        temperature=0,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+    resources["agent"] = HandbookAgent(
+        model=llm,
+        semantic_cache=SemanticCache(),
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+    # Index chargé au démarrage plutôt qu'à la première requête utilisateur
+    try:
+        await asyncio.to_thread(resources["agent"].warmup)
+    except Exception as e:
+        print(f"Warm-up ignore : {e}")
     print("Agent pret")
     yield
+    for task in compactions:
+        task.cancel()
     resources.clear()
+    thread_locks.clear()
+    inflight.clear()
+    http_client.close()
+    await http_async_client.aclose()
     print("Arret — ressources liberees")
 
 
@@ -115,7 +207,7 @@ def health():
 
 
 @app.post("/ask", response_model=AskResponse)
-def ask(request: AskRequest):
+async def ask(request: AskRequest):
     """
     Meme thread_id entre les requetes = l'agent se souvient des echanges
     precedents grace a MemorySaver.
@@ -128,9 +220,10 @@ def ask(request: AskRequest):
         raise HTTPException(status_code=503, detail="Agent non initialise")
 
     try:
-        answer, source = resources["agent"](
-            request.question,
-            thread_id=request.thread_id,
+        # shield : un client qui abandonne (ou expire) n'annule pas la tâche partagée
+        answer, source = await asyncio.wait_for(
+            asyncio.shield(_shared_answer(request.question, request.thread_id)),
+            timeout=INFLIGHT_TIMEOUT,
         )
         return AskResponse(
             answer=answer,
@@ -138,9 +231,46 @@ def ask(request: AskRequest):
             question=request.question,
         )
 
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Delai de reponse depasse")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# POST /ask/stream
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: AskRequest):
+    """
+    Meme contrat que /ask, mais la reponse arrive token par token (Server-Sent Events) :
+        event: token  data: "<texte>"                     (repete)
+        event: done   data: {"answer": ..., "source": ..., "question": ...}
+        event: error  data: {"detail": ...}
+    """
+    if "agent" not in resources:
+        raise HTTPException(status_code=503, detail="Agent non initialise")
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def events():
+        try:
+            async with _thread_lock(request.thread_id):
+                async for item in resources["agent"].astream(
+                    request.question,
+                    thread_id=request.thread_id,
+                ):
+                    if "token" in item:
+                        yield sse("token", item["token"])
+                    else:
+                        yield sse("done", {**item, "question": request.question})
+            _schedule_compaction(request.thread_id)
+        except Exception as e:
+            yield sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 if __name__ == "__main__":
     uvicorn.run("src.api.app:app", host="0.0.0.0", port=8000, reload=True)
@@ -6,22 +6,210 @@
 
 Lancer avec :
     uv run python main.py
+    uv run python main.py --batch questions.jsonl [--concurrency 16] > answers.jsonl
 """
 
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from rich.console import Console
-from rich.markdown import Markdown
 from rich.panel import Panel
-from rich.prompt import Prompt
 
-from src.agent.agent import HandbookAgent
+# langchain / agent / prompt_toolkit / rich.markdown : importés dans main_async(),
+# après la bannière → l'utilisateur voit l'interface avant le chargement lourd
+if TYPE_CHECKING:
+    from src.agent.agent import HandbookAgent
 
-load_dotenv()
 console = Console()
 
+GRAPH_PNG_PATH = Path("graph.png")
+CACHE_DIR = Path(".cache")
+EXIT_COMMANDS = frozenset({"exit", "quit", "q"})
+BATCH_CONCURRENCY = 16  # questions en vol en mode --batch (appels LLM I/O-bound)
 
-def main():
+
+# Pool HTTP unique pour toute la session (LLM, classifieur, embeddings) → keep-alive,
+# pas de handshake TLS par tour
+HTTP_MAX_CONNECTIONS = 64
+HTTP_TIMEOUT = 60.0
+
+
+def http_async_client():
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT),
+    )
+
+
+SESSION_ID_PATH = CACHE_DIR / "session_id"
+
+
+def session_id() -> str:
+    """Identifiant stable du poste, conservé entre les lancements."""
+    if SESSION_ID_PATH.exists():
+        return SESSION_ID_PATH.read_text().strip()
+    sid = uuid.uuid4().hex
+    SESSION_ID_PATH.parent.mkdir(exist_ok=True)
+    SESSION_ID_PATH.write_text(sid)
+    return sid
+
+
+def build_agent(http_client) -> "HandbookAgent":
+    from langchain_openai import ChatOpenAI
+
+    from src.agent.agent import HandbookAgent
+    from src.agent.semantic_cache import (DEFAULT_SEMANTIC_CACHE_PATH,
+                                          SemanticCache)
+
+    sid = session_id()
+    # Prompt caching OpenAI : le préfixe statique des prompts (system prompt de generate
+    # en tête, puis contexte, puis historique) est identique d'un appel à l'autre ; une
+    # clé stable route les requêtes de la session vers le même cache de préfixe
+    llm = ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0,
+        http_async_client=http_client,
+        extra_body={"prompt_cache_key": sid},
+    )
+    # Cache sémantique persistant : une question (ou paraphrase) déjà posée lors d'une
+    # session précédente est servie sans retrieval ni génération
+    return HandbookAgent(
+        model=llm,
+        semantic_cache=SemanticCache(threshold=0.95, path=DEFAULT_SEMANTIC_CACHE_PATH),
+        http_async_client=http_client,
+        thread_id=sid,
+    )
+
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    """
+    Écrit `data` seulement si le contenu diffère (pas d'I/O pour un graphe inchangé),
+    via un fichier temporaire + os.replace → jamais de PNG tronqué sur Ctrl+C.
+    """
+    if path.exists() and path.stat().st_size == len(data) and path.read_bytes() == data:
+        return False
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return True
+
+
+def dump_graph(agent: "HandbookAgent"):
+    """
+    Diagnostic développeur (HANDBOOK_DUMP_GRAPH=1) : rendu Mermaid du graphe en PNG.
+    Le rendu passe par un service distant → mis en cache par hash du diagramme.
+    """
+    graph = agent.graph.get_graph()
+    sig = hashlib.sha1(graph.draw_mermaid().encode()).hexdigest()[:12]
+    cache_path = CACHE_DIR / f"graph-{sig}.png"
+    if cache_path.exists():
+        png = cache_path.read_bytes()
+    else:
+        png = graph.draw_mermaid_png()
+        cache_path.parent.mkdir(exist_ok=True)
+        write_if_changed(cache_path, png)
+    if write_if_changed(GRAPH_PNG_PATH, png):
+        console.print(f"[dim]Saved {GRAPH_PNG_PATH}[/]")
+
+
+PANEL_PADDING = (1, 2)
+LIVE_REFRESH_PER_SECOND = 12
+RENDER_CACHE_SIZE = 128  # réponses déjà mises en page (cache sémantique, répétitions)
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def rendered_markdown(answer: str, width: int):
+    """Markdown parsé et mis en page une fois par (réponse, largeur), puis rejoué tel quel."""
+    from rich.markdown import Markdown
+    from rich.segment import Segments
+
+    options = console.options.update_width(width)
+    return Segments(list(console.render(Markdown(answer), options)))
+
+
+# Style du panneau final par source, formaté une fois (pas de if/elif ni f-string par tour)
+PANELS = {
+    "handbook": {"border": "green", "title": "📚  [green]HANDBOOK[/green]"},
+    "conversational": {"border": "cyan", "title": "💬  [cyan]CONVERSATIONAL[/cyan]"},
+    "off_topic": {"border": "red", "title": "⚠️  [red]OFF_TOPIC[/red]"},
+}
+
+
+def render_answer(answer: str, source: str) -> Panel:
+    style = PANELS.get(source, PANELS["off_topic"])
+
+    # largeur intérieure du panneau : bordures (2) + padding horizontal
+    width = console.width - 2 - 2 * PANEL_PADDING[1]
+    return Panel(
+        rendered_markdown(answer, width),
+        title=style["title"],
+        border_style=style["border"],
+        padding=PANEL_PADDING,
+    )
+
+
+async def ask(agent: "HandbookAgent", question: str):
+    """Affiche la réponse token par token, puis le panneau final (couleur selon la source)."""
+    from rich.live import Live
+    from rich.markdown import Markdown
+
+    loop = asyncio.get_running_loop()
+    buffer: list[str] = []
+    last_render = 0.0
+    with Live(console=console, transient=False, refresh_per_second=LIVE_REFRESH_PER_SECOND) as live:
+        async for event in agent.astream(question):
+            if "token" in event:
+                buffer.append(event["token"])
+                # Markdown(...) parse tout le texte → reconstruit au plus une fois par tick,
+                # pas à chaque token (coût borné quel que soit le débit de tokens)
+                now = loop.time()
+                if now - last_render >= 1 / LIVE_REFRESH_PER_SECOND:
+                    live.update(
+                        Panel(Markdown("".join(buffer)), border_style="dim", padding=PANEL_PADDING),
+                        refresh=False,
+                    )
+                    last_render = now
+            else:
+                live.update(render_answer(event["answer"], event["source"]), refresh=True)
+
+
+async def warm_up(agent: "HandbookAgent"):
+    """
+    Pendant que l'utilisateur lit la bannière / tape sa question : connexion TLS/HTTP2
+    ouverte dans le pool partagé, index Chroma chargé, tokenizer prêt. Erreurs ignorées.
+    """
+    import tiktoken
+
+    async def ping():
+        # GET /v1/models : requête non facturée, via le client OpenAI du LLM → même pool
+        await agent.model.root_async_client.models.list()
+
+    await asyncio.gather(
+        ping(),
+        asyncio.to_thread(agent.warmup),
+        asyncio.to_thread(tiktoken.encoding_for_model, "gpt-4o-mini"),
+        return_exceptions=True,
+    )
+
+
+async def main_async():
+    # lecture du .env (disque) en parallèle de l'affichage de la bannière
+    dotenv = asyncio.create_task(asyncio.to_thread(load_dotenv))
 
     console.print(
         Panel(
@@ -32,58 +220,158 @@ def main():
         )
     )
 
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    agent = HandbookAgent(model=llm)
-    png_bytes = agent.graph.get_graph().draw_mermaid_png()
+    await dotenv
+    with console.status("[dim]Chargement de l'agent...[/]"):
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.formatted_text import HTML
+        from prompt_toolkit.patch_stdout import patch_stdout
+
+        http_client = http_async_client()
+        agent = build_agent(http_client)
+    # référence gardée : la boucle ne conserve qu'une référence faible vers les tâches
+    warm = asyncio.create_task(warm_up(agent))
+    # rendu Mermaid (réseau) en tâche de fond : le premier prompt ne l'attend pas
+    graph_dump = (
+        asyncio.create_task(asyncio.to_thread(dump_graph, agent))
+        if os.environ.get("HANDBOOK_DUMP_GRAPH") == "1"
+        else None
+    )
 
-    with open("graph.png", "wb") as f:
-        f.write(png_bytes)
+    # Saisie et réponses découplées : on peut taper la question suivante pendant
+    # que la précédente est en cours (traitées dans l'ordre, même conversation)
+    session = PromptSession()
+    # prompt parsé une fois (HTML → fragments), réutilisé à chaque tour
+    ask_prompt = HTML("\n<b><ansicyan>❓ Question</ansicyan></b> : ")
+    questions: asyncio.Queue[str | None] = asyncio.Queue()
+    render_lock = asyncio.Lock()  # un seul panneau Rich à la fois
 
-    print("Saved graph.png")
-    while True:
-        # ── Lire la question ──────────────────────────────────────────────
+    async def read_questions():
+        while True:
+            # ── Lire la question ──────────────────────────────────────────
+            try:
+                question = await session.prompt_async(ask_prompt)
+            except (KeyboardInterrupt, EOFError):
+                # Ctrl+C ou Ctrl+D → sortie propre
+                break
+
+            question = question.strip()
+
+            # ── Question vide ─────────────────────────────────────────────
+            if not question:
+                async with render_lock:
+                    console.print("[dim]Pose une question ou tape 'exit' pour quitter.[/]")
+                continue
+
+            # ── Commandes de sortie ───────────────────────────────────────
+            if question.lower() in EXIT_COMMANDS:
+                break
+
+            await questions.put(question)
+        await questions.put(None)
+
+    async def answer_questions():
+        compaction = None
         try:
-            question = Prompt.ask("\n[bold cyan]❓ Question[/]")
-        except (KeyboardInterrupt, EOFError):
-            # Ctrl+C ou Ctrl+D → sortie propre
-            break
-
-        # ── Commandes de sortie ───────────────────────────────────────────
-        if question.strip().lower() in {"exit", "quit", "q"}:
-            break
-
-        # ── Question vide ─────────────────────────────────────────────────
-        if not question.strip():
-            console.print("[dim]Pose une question ou tape 'exit' pour quitter.[/]")
-            continue
-
-        # ── Appel à l'agent ───────────────────────────────────────────────
-        console.print()
-        answer, source = agent(question)
-
-        # ── Affichage de la réponse ───────────────────────────────────────
-        if source == "handbook":
-            icon = "📚"
-            border_color = "green"
-        elif source == "conversational":
-            icon = "💬"
-            border_color = "cyan"
-        else:  # off_topic
-            icon = "⚠️"
-            border_color = "red"
-
-        console.print(
-            Panel(
-                Markdown(answer),
-                title=f"{icon}  [{border_color}]{source.upper()}[/{border_color}]",
-                border_style=border_color,
-                padding=(1, 2),
-            )
-        )
+            while (question := await questions.get()) is not None:
+                # résumé de l'historique lancé au tour précédent : normalement déjà fini
+                # pendant que l'utilisateur tapait (erreurs ignorées, historique inchangé)
+                if compaction is not None:
+                    await asyncio.gather(compaction, return_exceptions=True)
+
+                # ── Appel à l'agent (réponse streamée) ────────────────────────
+                async with render_lock:
+                    console.print()
+                    await ask(agent, question)
+
+                compaction = asyncio.create_task(agent.acompact())
+        finally:
+            if compaction is not None:
+                compaction.cancel()
+
+    with patch_stdout(raw=True):
+        reader = asyncio.create_task(read_questions())
+        try:
+            await answer_questions()
+        except asyncio.CancelledError:
+            reader.cancel()
+            raise
+        finally:
+            await http_client.aclose()
 
     # ── Message de sortie ─────────────────────────────────────────────────
     console.print("\n[dim]À bientôt 👋[/]\n")
 
 
+async def run_batch(path: Path, concurrency: int):
+    """
+    Mode --batch : une question par ligne JSONL ({"question": ...}), traitées en
+    parallèle par un seul agent ; écrit {question, answer, source} en JSONL sur stdout
+    (dans l'ordre du fichier), ou {question, error} pour une question en échec.
+    Logs sur stderr.
+    """
+    log = Console(stderr=True)
+    await asyncio.to_thread(load_dotenv)
+    with path.open() as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+
+    with log.status(f"[dim]{len(questions)} questions...[/]"):
+        async with http_async_client() as http_client:
+            agent = build_agent(http_client)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(i: int, question: str) -> tuple[str, str]:
+                async with semaphore:
+                    # un thread par question : pas d'historique partagé entre questions
+                    return await agent.ainvoke(question, thread_id=f"batch-{i}")
+
+            # une question en échec (rate limit, timeout) ne perd pas les autres réponses
+            results = await asyncio.gather(
+                *(one(i, q) for i, q in enumerate(questions)), return_exceptions=True
+            )
+
+    errors = 0
+    for question, result in zip(questions, results):
+        if isinstance(result, Exception):
+            errors += 1
+            record = {"question": question, "error": f"{type(result).__name__}: {result}"}
+        else:
+            answer, source = result
+            record = {"question": question, "answer": answer, "source": source}
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+    log.print(f"[green]{len(results) - errors} réponses écrites[/]")
+    if errors:
+        log.print(f"[red]{errors} questions en échec (champ \"error\")[/]")
+
+
+def event_loop_factory():
+    """
+    uvloop (libuv) si disponible : sélecteur plus rapide pour les nombreuses petites
+    lectures socket du streaming LLM. Absent (Windows) → boucle asyncio standard.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop.new_event_loop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agile Lab Handbook Assistant")
+    parser.add_argument("--batch", type=Path, help="fichier JSONL de questions ({\"question\": ...})")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args()
+    loop_factory = event_loop_factory()
+
+    if args.batch:
+        asyncio.run(run_batch(args.batch, args.concurrency), loop_factory=loop_factory)
+        return
+
+    try:
+        asyncio.run(main_async(), loop_factory=loop_factory)
+    except KeyboardInterrupt:
+        console.print("\n[dim]À bientôt 👋[/]\n")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,99 @@
+"""
+Smoke test de HandbookAgent : un tour complet à travers le graphe compilé
+(__call__ / ainvoke / astream), avec un chat model factice et une collection
+Chroma temporaire → aucun appel réseau.
+"""
+
+import asyncio
+import itertools
+
+import pytest
+from langchain_core.language_models.fake_chat_models import \
+    GenericFakeChatModel
+from langchain_core.runnables import RunnableLambda
+
+from src.agent import agent as agent_module
+from src.agent.agent import HandbookAgent
+
+QUESTION = "How many vacation days do I get?"
+GREETING = "hi"
+DOC_ID = "doc-1"
+ANSWER = "Twenty-five days."
+
+
+class FakeChatModel(GenericFakeChatModel):
+    # with_structured_output exige bind_tools ; les sorties structurées ne sont pas
+    # sollicitées ici (salutation → intent direct, score élevé → pas de jugement)
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(agent_module, "CHROMA_DIR", str(tmp_path / "chroma"))
+    monkeypatch.setattr(agent_module, "COLLECTION_NAME", "smoke")
+
+    # une chaîne → un nouvel AIMessage (nouvel id) par appel
+    model = FakeChatModel(messages=itertools.repeat(ANSWER))
+    agent = HandbookAgent(
+        model=model,
+        # doc retrouvé par id (cache de retrieval) → pas d'embedding de la question
+        retrieval_cache={
+            q: {"doc_ids": [DOC_ID], "scores": [0.9]} for q in (QUESTION, GREETING)
+        },
+    )
+    agent.vectorstore._collection.add(
+        ids=[DOC_ID],
+        documents=["Employees get 25 vacation days per year."],
+        metadatas=[{"title": "Vacation", "chunk_id": 0}],
+        embeddings=[[1.0, 0.0, 0.0]],
+    )
+    agent.fast_classifier = RunnableLambda(lambda _: "handbook")
+    return agent
+
+
+def test_call_answers_from_handbook(agent):
+    answer, source = agent(QUESTION, thread_id="sync")
+
+    assert (answer, source) == (ANSWER, "handbook")
+    messages = agent.graph.get_state(agent._config("sync")).values["messages"]
+    assert [m.type for m in messages] == ["human", "ai"]
+
+
+def test_ainvoke_keeps_thread_history(agent):
+    async def run():
+        await agent.ainvoke(QUESTION, thread_id="async")
+        return await agent.ainvoke(GREETING, thread_id="async")
+
+    answer, source = asyncio.run(run())
+
+    assert source == "conversational"
+    messages = agent.graph.get_state(agent._config("async")).values["messages"]
+    assert len(messages) == 4
+
+
+def test_astream_ends_with_answer(agent):
+    async def run():
+        return [event async for event in agent.astream(QUESTION, thread_id="stream")]
+
+    events = asyncio.run(run())
+
+    assert "".join(e["token"] for e in events if "token" in e) == ANSWER
+    assert events[-1] == {"answer": ANSWER, "source": "handbook"}
+
+
+def test_acompact_folds_old_turns_into_summary(agent, monkeypatch):
+    monkeypatch.setattr(agent_module, "SUMMARY_TRIGGER_TOKENS", 0)
+
+    async def run():
+        for _ in range(4):
+            await agent.ainvoke(QUESTION, thread_id="long")
+        compacted = await agent.acompact("long")
+        await agent.ainvoke(QUESTION, thread_id="long")
+        return compacted
+
+    assert asyncio.run(run())
+    values = agent.graph.get_state(agent._config("long")).values
+    assert values["summary"] == ANSWER
+    assert len(values["messages"]) == agent_module.HISTORY_WINDOW + 2